@@ -1,14 +1,38 @@
+import asyncio
+import atexit
+import base64
+import binascii
+import hashlib
+import ipaddress
+import json
+import os
+import subprocess
+import sys
+import time
 from datetime import datetime, timezone
+from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Header, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from cfupdater import get_updatable_hosts, get_last_update, get_previous_ip, get_last_check
-from globals import API_PORT, UPDATE_INTERVAL, API_TOKEN
+from metrics import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from shared_status import SharedStatusReader, forward_push
+from singleton_logger import error
+from status import StatusSnapshot, get_status
+from globals import (API_PORT, API_MODE, API_MODE_PROCESS, API_WORKERS, UPDATE_INTERVAL, API_TOKEN, IP_VERSIONS,
+                     RECORD_TYPES)
 
 app = FastAPI(title="DynCFDNS API", version="1.0.0")
 __UNAUTHORIZED = "Unauthorized"
+MAX_PUSHED_HOSTS: int = 20  # Hosts a single /nic/update may name, like dyndns2 services
+API_RESTART_DELAY: float = 5.0  # Seconds before the API process is started again, in 'process' mode
+SSE_POLL_INTERVAL: float = 1.0  # Seconds between two checks of the status, for each /events stream
+SSE_KEEPALIVE_INTERVAL: float = 15.0  # Seconds of silence after which a stream gets a keepalive comment
+__widget_cache: tuple = ()  # (inputs, etag, body, data) of the last /widget payload built
+# In 'process' mode, this module runs in the API worker processes: the updater state comes from shared memory
+__shared_status: Optional[SharedStatusReader] = SharedStatusReader() if API_MODE == API_MODE_PROCESS else None
 
 def __format_datetime_iso8859(dt):
     """Format datetime to ISO-8859-1 compatible string."""
@@ -19,9 +43,30 @@ def __format_datetime_iso8859(dt):
     return str(dt)
 
 
-def __is_status_good() -> bool:
-    last_check = get_last_check()
-    return last_check and (datetime.now(timezone.utc) - last_check).total_seconds() <= (UPDATE_INTERVAL + 15)
+def __get_status() -> StatusSnapshot:
+    return __shared_status.status() if __shared_status is not None else get_status()
+
+
+def __push_external_ips(hostnames: list[str], ips: dict) -> Optional[dict]:
+    if __shared_status is not None:
+        return forward_push(hostnames, ips)
+    # Imported here: the API worker processes never load the updater
+    from cfupdater import push_external_ips
+    return push_external_ips(hostnames, ips)
+
+
+def __is_global_address(address: str) -> bool:
+    """Whether the address parses and is publicly routable (not private, loopback, CGNAT, ...)."""
+    try:
+        return ipaddress.ip_address(address).is_global
+    except ValueError:
+        return False
+
+
+def __is_status_good(status: Optional[StatusSnapshot] = None) -> bool:
+    status = status or __get_status()
+    interval = status.check_interval or UPDATE_INTERVAL
+    return status.last_check and (datetime.now(timezone.utc) - status.last_check).total_seconds() <= (interval + 15)
 
 
 def __verify_api_token(authorization: str = Header(None)):
@@ -32,8 +77,14 @@ def __verify_api_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header required")
 
-    # Support both "Bearer TOKEN" and "TOKEN" formats
-    token = authorization.replace("Bearer ", "").strip()
+    # Support "Bearer TOKEN", "TOKEN" and, for dyndns2 clients, "Basic base64(any user:TOKEN)" formats
+    if authorization.startswith("Basic "):
+        try:
+            token = base64.b64decode(authorization[6:].strip()).decode().partition(':')[2]
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(status_code=401, detail="Invalid Basic authorization header")
+    else:
+        token = authorization.replace("Bearer ", "").strip()
 
     if token != API_TOKEN:
         raise HTTPException(status_code=403, detail=__UNAUTHORIZED)
@@ -41,52 +92,183 @@ def __verify_api_token(authorization: str = Header(None)):
     return True
 
 
+def __build_widget_data(status: StatusSnapshot) -> dict:
+    valid_hosts = status.hosts
+
+    host_count = len(valid_hosts) if valid_hosts else 0
+    # hosts = '\n'.join([host for host in valid_hosts if host])
+    hosts = [host for host in valid_hosts] if valid_hosts else []
+    is_active = 'active' if __is_status_good(status) else 'unhealthy'
+
+    response_data = {
+        'last_check': __format_datetime_iso8859(status.last_check) or "Never",
+        'last_update': __format_datetime_iso8859(status.last_update) or "Never",
+        'host_count': host_count,
+        'hosts': hosts,
+        'current_ip': status.current_ip or 'Unknown',
+        'status': is_active
+    }
+    if 6 in IP_VERSIONS:
+        response_data['current_ipv6'] = status.current_ipv6 or 'Unknown'
+    return response_data
+
+
+def __get_widget() -> tuple[str, bytes, dict]:
+    """The widget data, its serialized body and its ETag. Rebuilt only when one of its inputs changed:
+    the status snapshot version or the health of the updater.
+    The API budget is left out: it refills every fraction of a second, and is the
+    dyncfdns_cloudflare_budget_remaining gauge of /metrics.
+    """
+    global __widget_cache
+    # One snapshot per request, so every field comes from the same moment
+    status = __get_status()
+    key = (status.version, __is_status_good(status))
+    if __widget_cache and __widget_cache[0] == key:
+        return __widget_cache[1:]
+    data = __build_widget_data(status)
+    # Serialized like JSONResponse does
+    body = json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    __widget_cache = (key, etag, body, data)
+    return etag, body, data
+
+
 @app.get("/widget")
-async def get_widget_data(authorized: bool = Depends(__verify_api_token)):
-    """Return simplified data for homepage widget."""
+async def get_widget_data(authorized: bool = Depends(__verify_api_token), if_none_match: str = Header(None)):
+    """Return simplified data for homepage widget. Answers 304 when the client's ETag is still current."""
     if not authorized:
         raise HTTPException(status_code=403, detail=__UNAUTHORIZED)
 
     try:
-        valid_hosts = get_updatable_hosts()
-
-        host_count = len(valid_hosts) if valid_hosts else 0
-        # hosts = '\n'.join([host for host in valid_hosts if host])
-        hosts = [host for host in valid_hosts] if valid_hosts else []
-        is_active = 'active' if __is_status_good() else 'unhealthy'
-
-        response_data = {
-            'last_check': __format_datetime_iso8859(get_last_check()) or "Never",
-            'last_update': __format_datetime_iso8859(get_last_update()) or "Never",
-            'host_count': host_count,
-            'hosts': hosts,
-            'current_ip': get_previous_ip() or 'Unknown',
-            'status': is_active
-        }
-        return JSONResponse(
-            content=response_data,
-            headers={"Content-Type": "application/json; charset=iso-8859-1"}
-        )
-
+        etag, body, _ = __get_widget()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve widget data: {str(e)}")
 
+    # The browsers revalidate every poll, and get an empty 304 while nothing changed
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and (if_none_match.strip() == '*' or
+                          etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, headers={**headers, "Content-Type": "application/json; charset=iso-8859-1"})
+
+
+async def __stream_widget_events(request: Request):
+    previous: dict = {}
+    last_sent = time.monotonic()
+    while not await request.is_disconnected():
+        try:
+            etag, _, data = __get_widget()
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+            return
+        # The full data first, then only the fields that changed
+        delta = {field: value for field, value in data.items() if previous.get(field, ...) != value}
+        if delta:
+            event, event_id = 'delta' if previous else 'status', etag.strip('"')
+            yield f"event: {event}\nid: {event_id}\ndata: {json.dumps(delta)}\n\n"
+            previous = data
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= SSE_KEEPALIVE_INTERVAL:
+            yield ": keepalive\n\n"  # A comment: keeps proxies from closing an idle stream
+            last_sent = time.monotonic()
+        await asyncio.sleep(SSE_POLL_INTERVAL)
+
+
+@app.get("/events")
+async def get_widget_events(request: Request, authorized: bool = Depends(__verify_api_token)):
+    """Server-Sent Events stream of the widget data: a 'status' event with all of it when the client
+    connects, then a 'delta' event with the fields that changed each time the status changes.
+    """
+    if not authorized:
+        raise HTTPException(status_code=403, detail=__UNAUTHORIZED)
+    return StreamingResponse(__stream_widget_events(request), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 @app.get("/health")
 async def health_check():
     """Simple health check endpoint."""
-    if __is_status_good():
+    status = __get_status()
+    if __is_status_good(status):
         return {"status": "ok"}
     else:
         return JSONResponse(
-            content={"status": "unhealthy", "last_check": (__format_datetime_iso8859(get_last_check()) or 'Never')},
+            content={"status": "unhealthy", "last_check": (__format_datetime_iso8859(status.last_check) or 'Never')},
             status_code=503
         )
 
 
+@app.get("/nic/update")
+async def nic_update(request: Request, hostname: str = '', myip: str = '', myipv6: str = '',
+                     authorization: str = Header(None)):
+    """dyndns2 update endpoint, for routers that report their external address themselves.
+
+    Answers in plain text, one line per host: good <ip>, nochg <ip> or nohost. Without myip, the
+    address the request comes from is used, as dyndns2 services do. Addresses that are not public
+    (private, loopback, CGNAT, ...) are refused with badip.
+    """
+    try:
+        __verify_api_token(authorization)
+    except HTTPException:
+        return PlainTextResponse("badauth", status_code=401, headers={"WWW-Authenticate": 'Basic realm="DynCFDNS"'})
+
+    hostnames = [host.strip().lower().rstrip('.') for host in hostname.split(',') if host.strip()]
+    if not hostnames:
+        return PlainTextResponse("notfqdn")
+    if len(hostnames) > MAX_PUSHED_HOSTS:
+        return PlainTextResponse("numhost")
+
+    # myip may hold both addresses, comma separated (e.g. FritzBox: myip=<ipaddr>,<ip6addr>)
+    addresses = [address.strip() for address in f"{myip},{myipv6}".split(',') if address.strip()]
+    if not addresses and request.client and __is_global_address(request.client.host):
+        # A router on the LAN has a private source address: only a public one can be the external address
+        addresses = [request.client.host]
+    ips = {}
+    for address in addresses:
+        if not __is_global_address(address):
+            return PlainTextResponse("badip", status_code=400)
+        ip = ipaddress.ip_address(address)
+        if ip.version in IP_VERSIONS:
+            ips[RECORD_TYPES[ip.version]] = str(ip)
+    if not ips:
+        return PlainTextResponse("badip", status_code=400)
+
+    results = await run_in_threadpool(__push_external_ips, hostnames, ips)
+    if results is None:
+        return PlainTextResponse("911", status_code=503)
+    pushed = ','.join(ips.values())
+    return PlainTextResponse('\n'.join(results[host] if results[host] == 'nohost' else f"{results[host]} {pushed}"
+                                       for host in hostnames))
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics endpoint (no authentication required, like /health)."""
+    content = __shared_status.metrics() if __shared_status is not None else registry.expose()
+    return Response(content=content, media_type=METRICS_CONTENT_TYPE)
+
+
 def start_api():
     """Start the API server."""
     if API_PORT <= 0:
         return
-    uvicorn.run(app, host="0.0.0.0", port=API_PORT, access_log=False)
+    if API_MODE == API_MODE_PROCESS:
+        # The workers import this module by name, in new processes
+        uvicorn.run("api:app", host="0.0.0.0", port=API_PORT, workers=API_WORKERS, access_log=False)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=API_PORT, access_log=False)
+
 
+def start_api_process():
+    """Run the API in its own processes ('process' mode), and start it again if it exits. Blocks."""
+    process: Optional[subprocess.Popen] = None
+    atexit.register(lambda: process is not None and process.terminate())
+    while True:
+        # A new interpreter: the API workers do not load the updater, nor share its GIL
+        # The updater alone writes the log file, and the app directory must be the working one for 'import api'
+        process = subprocess.Popen([sys.executable, '-c', 'import api; api.start_api()'],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env={**os.environ, 'LOG_TO_FILE': 'false'})
+        code = process.wait()
+        error(f"The API process exited with code {code}. Starting it again in {API_RESTART_DELAY:.0f} seconds.")
+        time.sleep(API_RESTART_DELAY)
@@ -0,0 +1,280 @@
+"""
+Local stand-ins for the Cloudflare v4 API, an ipify-style IP echo service and Cloudflare's
+authoritative nameservers.
+
+Only what DynCFDNS uses is implemented: listing zones, listing/creating/updating DNS records
+and the dns_records/batch endpoint, and A/AAAA queries over UDP. Latency, page sizes and 429
+injection are configurable, and every request is counted so the benchmarks can report API usage.
+"""
+import ipaddress
+import json
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeCloudflareState:
+    """Zones, records and request counters shared by the request handler threads."""
+
+    def __init__(self, latency: float = 0.0, max_per_page: int = 5000, zones_max_per_page: int = 50,
+                 rate_limit_every: int = 0, retry_after: float = 0.0):
+        self.latency = latency
+        self.max_per_page = max_per_page
+        self.zones_max_per_page = zones_max_per_page
+        self.rate_limit_every = rate_limit_every  # Every Nth request gets a 429. 0 disables it.
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.zones: dict = {}     # zone id -> zone name
+        self.records: dict = {}   # record id -> record dict
+        self.requests: Counter = Counter()
+        self.total_requests = 0
+        self.dns_queries = 0
+
+    def seed(self, zone_count: int, host_count: int, content: str = '192.0.2.1') -> list[str]:
+        """Create zone_count zones and host_count A records spread across them. Returns the host names."""
+        with self.lock:
+            # Stable zone IDs, like real zones: seeding again only replaces the records
+            self.zones = {uuid.uuid5(uuid.NAMESPACE_DNS, f'bench-zone{z}.com').hex: f'bench-zone{z}.com'
+                          for z in range(zone_count)}
+            self.records = {}
+            zone_ids = list(self.zones)
+            hosts = []
+            for i in range(host_count):
+                zone_id = zone_ids[i % zone_count]
+                name = f'host{i}.{self.zones[zone_id]}'
+                record_id = uuid.uuid4().hex
+                self.records[record_id] = {
+                    'id': record_id, 'zone_id': zone_id, 'type': 'A', 'name': name, 'content': content,
+                    'proxied': False, 'ttl': 1, 'modified_on': '2025-01-01T00:00:00Z'
+                }
+                hosts.append(name)
+            return hosts
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+            self.total_requests = 0
+            self.dns_queries = 0
+
+    def count(self, operation: str) -> bool:
+        """Count a request. Returns False when it must be answered with a 429."""
+        with self.lock:
+            self.requests[operation] += 1
+            self.total_requests += 1
+            if self.rate_limit_every and self.total_requests % self.rate_limit_every == 0:
+                self.requests['rate_limited'] += 1
+                return False
+            return True
+
+
+def _envelope(result, result_info: Optional[dict] = None, success: bool = True, errors: Optional[list] = None) -> dict:
+    body = {'success': success, 'errors': errors or [], 'messages': [], 'result': result}
+    if result_info is not None:
+        body['result_info'] = result_info
+    return body
+
+
+def make_cloudflare_handler(state: FakeCloudflareState):
+    class CloudflareHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body: dict, status: int = 200, headers: Optional[dict] = None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_body(self) -> dict:
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length)) if length else {}
+
+        def _admit(self, operation: str) -> bool:
+            if state.latency:
+                time.sleep(state.latency)
+            if state.count(operation):
+                return True
+            self._read_body()
+            self._send(_envelope(None, success=False, errors=[{'code': 10000, 'message': 'Rate limited'}]),
+                       429, {'Retry-After': str(state.retry_after)})
+            return False
+
+        def _page(self, items: list, query: dict, max_per_page: int):
+            page = max(1, int(float(query.get('page', ['1'])[0])))
+            per_page = min(max_per_page, int(float(query.get('per_page', ['20'])[0])))
+            chunk = items[(page - 1) * per_page:page * per_page]
+            total_pages = (len(items) + per_page - 1) // per_page
+            self._send(_envelope(chunk, {'page': page, 'per_page': per_page, 'count': len(chunk),
+                                         'total_count': len(items), 'total_pages': total_pages}))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip('/').split('/')
+            if parts[-1] == 'zones':
+                if not self._admit('zones.list'):
+                    return
+                with state.lock:
+                    zones = [{'id': zone_id, 'name': name, 'status': 'active',
+                              'name_servers': ['ada.ns.cloudflare.com', 'bob.ns.cloudflare.com']}
+                             for zone_id, name in state.zones.items()
+                             if 'name' not in query or query['name'][0] == name]
+                return self._page(zones, query, state.zones_max_per_page)
+            if parts[-2] == 'zones':
+                if not self._admit('zones.get'):
+                    return
+                with state.lock:
+                    name = state.zones.get(parts[-1])
+                if name is None:
+                    return self._send(_envelope(None, success=False, errors=[{'code': 7003, 'message': 'No route'}]), 404)
+                return self._send(_envelope({'id': parts[-1], 'name': name, 'status': 'active',
+                                             'name_servers': ['ada.ns.cloudflare.com', 'bob.ns.cloudflare.com']}))
+            if parts[-1] == 'dns_records':
+                if not self._admit('records.list'):
+                    return
+                zone_id = parts[-2]
+                with state.lock:
+                    records = [r for r in state.records.values() if r['zone_id'] == zone_id
+                               and ('name' not in query or r['name'] == query['name'][0])
+                               and ('type' not in query or r['type'] == query['type'][0])]
+                return self._page(records, query, state.max_per_page)
+            self._send(_envelope(None, success=False, errors=[{'code': 7003, 'message': 'No route'}]), 404)
+
+        def do_PUT(self):
+            if not self._admit('records.update'):
+                return
+            body = self._read_body()
+            record_id = urlparse(self.path).path.rstrip('/').split('/')[-1]
+            with state.lock:
+                record = state.records.get(record_id)
+                if record is not None:
+                    record.update({k: v for k, v in body.items() if k in ('content', 'type', 'name', 'proxied', 'ttl')})
+                    record = dict(record)
+            if record is None:
+                return self._send(_envelope(None, success=False, errors=[{'code': 81044, 'message': 'Record does not exist.'}]), 404)
+            self._send(_envelope(record))
+
+        do_PATCH = do_PUT
+
+        def do_POST(self):
+            path = urlparse(self.path).path.strip('/').split('/')
+            if path[-1] == 'batch':
+                if not self._admit('records.batch'):
+                    return
+                body = self._read_body()
+                patched = []
+                with state.lock:
+                    patches = body.get('patches', [])
+                    if any(p['id'] not in state.records for p in patches):
+                        # Like Cloudflare, a batch is all or nothing
+                        return self._send(_envelope(None, success=False, errors=[{'code': 81044, 'message': 'Record does not exist.'}]), 400)
+                    for patch in patches:
+                        state.records[patch['id']].update({k: v for k, v in patch.items() if k != 'id'})
+                        patched.append(dict(state.records[patch['id']]))
+                return self._send(_envelope({'patches': patched, 'deletes': [], 'posts': [], 'puts': []}))
+            if not self._admit('records.create'):
+                return
+            body = self._read_body()
+            zone_id = path[-2]
+            record_id = uuid.uuid4().hex
+            record = dict(body, id=record_id, zone_id=zone_id, modified_on='2025-01-01T00:00:00Z')
+            with state.lock:
+                state.records[record_id] = record
+            self._send(_envelope(record))
+
+    return CloudflareHandler
+
+
+def make_ip_echo_handler(state: dict):
+    """state['ip'] is the address returned, state['latency'] the delay, state['requests'] the request count."""
+
+    class IPEchoHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if state.get('latency'):
+                time.sleep(state['latency'])
+            state['requests'] = state.get('requests', 0) + 1
+            payload = json.dumps({'ip': state['ip']}).encode()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client lost the race and hung up
+
+    return IPEchoHandler
+
+
+# Cloudflare answers for proxied records with its own anycast addresses, not with their content
+PROXY_ADDRESSES: dict = {'A': '104.16.0.1', 'AAAA': '2606:4700::6810:1'}
+
+
+def make_dns_handler(state: FakeCloudflareState):
+    """Answers A/AAAA queries for the names of state.records, like an authoritative nameserver.
+    Names outside the zones are REFUSED. Names with no record at all get NXDOMAIN.
+    """
+
+    class DNSHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            query_id = struct.unpack_from('!H', data)[0]
+            offset, labels = 12, []
+            while data[offset]:
+                labels.append(data[offset + 1:offset + 1 + data[offset]].decode().lower())
+                offset += 1 + data[offset]
+            query_type = struct.unpack_from('!H', data, offset + 1)[0]
+            question = data[12:offset + 5]
+            name = '.'.join(labels)
+            record_type = {1: 'A', 28: 'AAAA'}.get(query_type)
+            with state.lock:
+                state.dns_queries += 1
+                in_zone = any(name == zone or name.endswith(f'.{zone}') for zone in state.zones.values())
+                records = [dict(r) for r in state.records.values() if r['name'] == name]
+            if not in_zone:
+                return sock.sendto(struct.pack('!HHHHHH', query_id, 0x8005, 1, 0, 0, 0) + question,
+                                   self.client_address)
+            answers = b''
+            matching = [r for r in records if r['type'] == record_type]
+            for record in matching:
+                address = PROXY_ADDRESSES[record_type] if record.get('proxied') else record['content']
+                raw = ipaddress.ip_address(address).packed
+                answers += b'\xc0\x0c' + struct.pack('!HHIH', query_type, 1, 300, len(raw)) + raw
+            flags = 0x8400 | (0 if records else 3)  # Response, authoritative, NOERROR or NXDOMAIN
+            sock.sendto(struct.pack('!HHHHHH', query_id, flags, 1, len(matching), 0, 0) + question + answers,
+                        self.client_address)
+
+    return DNSHandler
+
+
+def serve_dns(handler_class) -> socketserver.ThreadingUDPServer:
+    """Start a UDP server on a free local port, in a daemon thread."""
+    server = socketserver.ThreadingUDPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve(handler_class) -> ThreadingHTTPServer:
+    """Start a server on a free local port, in a daemon thread."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Measures how startup (assemble_hosts_records) and IP-change fan-out (update_dns_records) scale,
+and what finding records edited out of band (drift) costs.
+
+The real DynCFDNS code paths run against the local stand-ins in fake_servers.py. The report
+shows the Cloudflare requests made, the wall time and the peak Python heap for each phase.
+
+Usage:
+    python benchmarks/run_benchmarks.py --hosts 10,100,1000,10000 --zones 5 --latency 0.02
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import (FakeCloudflareState, make_cloudflare_handler, make_dns_handler,  # noqa: E402
+                          make_ip_echo_handler, serve, serve_dns)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', default='10,100,1000,10000', help='Comma-separated host counts')
+    parser.add_argument('--zones', type=int, default=5, help='Number of zones the hosts are spread across')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every fake API response')
+    parser.add_argument('--per-page', type=int, default=5000, help='Largest page size the fake API accepts')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='Answer every Nth request with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='Retry-After sent with injected 429s')
+    parser.add_argument('--drift', type=float, default=0.01, help='Share of the records edited out of band '
+                                                                  'before the drift phase')
+    parser.add_argument('--dns-probe', action='store_true', help='Find drift on the fake authoritative '
+                                                                 'nameserver (DNS_PROBE) instead of the API')
+    return parser.parse_args()
+
+
+def measure(function, *args):
+    """Run function(*args) and return (result, wall seconds, peak heap bytes)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = function(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def format_requests(state: FakeCloudflareState) -> str:
+    requests = ', '.join(f'{operation}={count}' for operation, count in sorted(state.requests.items())) or '-'
+    return f'{requests}, dns={state.dns_queries}' if state.dns_queries else requests
+
+
+def main():
+    args = parse_args()
+    state = FakeCloudflareState(latency=args.latency, max_per_page=args.per_page,
+                                rate_limit_every=args.rate_limit_every, retry_after=args.retry_after)
+    ip_state = {'ip': '198.51.100.1'}
+    cloudflare_server = serve(make_cloudflare_handler(state))
+    ip_server = serve(make_ip_echo_handler(ip_state))
+    dns_server = serve_dns(make_dns_handler(state))
+
+    # The DynCFDNS modules read their configuration at import time
+    os.environ['CLOUDFLARE_BASE_URL'] = f'http://127.0.0.1:{cloudflare_server.server_port}/client/v4'
+    os.environ['IP_SOURCES'] = 'custom'
+    os.environ['IP_SOURCE_CUSTOM_URL'] = f'http://127.0.0.1:{ip_server.server_port}/'
+    os.environ.setdefault('API_PORT', '0')
+    # main() marks the records as reconciled at startup. Here the fan-out phase measures the writes only.
+    os.environ.setdefault('RECONCILE_INTERVAL', '0')
+    if args.dns_probe:
+        os.environ['DNS_PROBE'] = 'true'
+        os.environ['DNS_PROBE_SERVERS'] = f'127.0.0.1:{dns_server.server_address[1]}'
+    # The config file (previous IP, record cache) is written relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='dyncfdns-bench-'))
+
+    import cfupdater
+    from host_groups import HostGroup
+    from singleton_logger import logger
+    logger.set_level(logging.WARNING)
+
+    # Unmeasured warm-up: the first startup also imports the Cloudflare SDK and its resource modules.
+    # Other credentials, so the measured runs don't find its zones and clients cached.
+    cfupdater.assemble_hosts_records('warmup', 'key', 'email', state.seed(args.zones, 1))
+
+    print(f"{'hosts':>7} {'phase':<8} {'wall (s)':>9} {'peak heap':>10}  requests")
+    for count, host_count in enumerate(int(h) for h in args.hosts.split(',')):
+        host_list = state.seed(args.zones, host_count)
+
+        group = HostGroup(f'bench{host_count}', host_list, 'token', 'key', 'email')
+        state.reset_counters()
+        group.hosts, elapsed, peak = measure(cfupdater.assemble_hosts_records, 'token', 'key', 'email', host_list)
+        print(f"{host_count:>7} {'startup':<8} {elapsed:>9.3f} {peak / 1024 / 1024:>8.1f}MB  "
+              f"{format_requests(state)} (resolved {len(group.hosts)})")
+
+        # A new address every round, so every record has to be written
+        ip_state['ip'] = f'198.51.100.{count + 2}'
+        state.reset_counters()
+        success, elapsed, peak = measure(cfupdater.update_dns_records, group)
+        print(f"{host_count:>7} {'fan-out':<8} {elapsed:>9.3f} {peak / 1024 / 1024:>8.1f}MB  "
+              f"{format_requests(state)} ({'ok' if success else 'FAILED'})")
+
+        # Some records are edited out of band, long after the fan-out, then a cycle runs with an unchanged IP
+        for host_info in group.hosts.values():
+            host_info['modified_on'] = None
+        with state.lock:
+            edited = list(state.records.values())[:int(host_count * args.drift)]
+            for record in edited:
+                record['content'] = '203.0.113.66'
+        state.reset_counters()
+        _, elapsed, peak = measure(cfupdater.update_dns_records, group)
+        with state.lock:
+            repaired = sum(1 for record in edited if record['content'] == ip_state['ip'])
+        print(f"{host_count:>7} {'drift':<8} {elapsed:>9.3f} {peak / 1024 / 1024:>8.1f}MB  "
+              f"{format_requests(state)} (repaired {repaired}/{len(edited)})")
+
+    cloudflare_server.shutdown()
+    ip_server.shutdown()
+    dns_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,87 @@
+from __future__ import annotations
+
 import os
+import signal
+import threading
 import time
 from datetime import datetime, timezone
-from threading import Lock
-from typing import Optional, Tuple
-
-import httpx
-import tldextract
-from cloudflare import Cloudflare
+from typing import TYPE_CHECKING, Optional, Tuple
 
-from globals import UPDATE_INTERVAL, NOT_FOUND, KEY_PREVIOUS_IP, load_attribute_from_config, save_attribute_to_config
+from dns_probe import probe_records, parse_servers, resolve_nameservers
+from domains import get_zone_for_host, start_suffix_list_refresh
+from globals import (UPDATE_INTERVAL, UPDATE_CONCURRENCY, NETLINK_WATCH, RECONCILE_INTERVAL, PSL_REFRESH,
+                     IP_VERSIONS, RECORD_TYPES, DNS_PROBE, DNS_PROBE_SERVERS, NOT_FOUND, KEY_PREVIOUS_IP,
+                     KEY_PREVIOUS_IPV6, KEY_RECORD_CACHE, load_attribute_from_config, save_attribute_to_config)
 from healthcheck import write_health_status
+from host_groups import HostGroup, load_host_groups, start_config_watch
+from http_clients import client_manager
+from ip_sources import discover_ips, get_sources_by_version
+from metrics import (cloudflare_request_seconds, cycle_seconds, record_updates_total, record_failures_total,
+                     skipped_cycles_total, dns_probe_total, host_count, quarantined_records)
+from netlink_watcher import NetlinkWatcher
+from rate_limiter import low_priority
+from record_cache import get_fingerprint, load_record_cache, save_record_cache
+from retry_queue import get_retry_after
+from scheduler import GroupScheduler
 from singleton_logger import info, warn, error
-
-__default_ip: str = '10.0.0.254'  # Default placeholder IP
-__previous_ip: str = ''
+from status import get_status, publish_status
+from update_engine import update_records_concurrently
+from zone_resolver import resolve_zones, get_zone_name_servers
+
+if TYPE_CHECKING:
+    # The Cloudflare SDK (and tldextract, in domains.py) are imported on first use: with the record
+    # cache, a restart with an unchanged IP does not need either of them
+    from cloudflare import Cloudflare
+
+UPDATED_RECORD_TYPES: tuple = tuple(RECORD_TYPES[version] for version in IP_VERSIONS)
+__default_ips: dict = {'A': '10.0.0.254', 'AAAA': 'fd00::fe'}  # Default placeholder IPs
+__previous_ip_keys: dict = {'A': KEY_PREVIOUS_IP, 'AAAA': KEY_PREVIOUS_IPV6}
+__status_ip_fields: dict = {'A': 'current_ip', 'AAAA': 'current_ipv6'}
 PREVIOUS_IP_FILENAME: str = 'logs/previous_ip.txt'
+RECORDS_PER_PAGE: int = 5000  # Largest page size accepted by the dns_records list endpoint
+INDEXED_RECORD_TYPES: tuple = ('A', 'AAAA')
+PROPAGATION_GRACE: float = 60.0  # Seconds the nameservers may keep serving the old content of a record just written
+__zone_nameservers: dict = {}  # zone id -> [(ip, port)] of its authoritative nameservers
 
 __last_check: Optional[datetime] = None
 __last_update: Optional[datetime] = None
-__updatable_hosts: dict = {}  # Dictionary to hold hosts that can be updated
+__groups: list[HostGroup] = []  # Set by main(). Each group holds its own records, retry queue and previous IPs
+
+# Set by main(). Woken up early when netlink reports an address change or the host configuration changes
+__scheduler: Optional[GroupScheduler] = None
+WAKE_SETTLE_DELAY: float = 2.0  # Seconds to let a burst of change events (and DHCP) settle
+# Addresses pushed through the API's /nic/update and not applied yet: group name -> {record type: address}.
+# Written by the API thread, taken by the updater thread at the group's next cycle
+__pushed_ips: dict = {}
+__pushed_ips_lock = threading.Lock()
 
-# Thread-safe lock for shared resources
-# This is an important thing: this Lock is necessary because some of these
-# global variables are accessed by both the main thread and the API thread.
-# The simple correct way to ensure both can access them safely is to use a lock.
-thread_safe_lock: Lock = Lock()
+# The globals above are only touched by the updater thread. The API thread reads the
+# immutable snapshot published through status.publish_status() instead, so it never has
+# to wait for an update cycle (and its network I/O) to finish.
 
 
-def get_external_ip() -> Optional[str]:
+def get_external_ips(sources_by_version: Optional[dict] = None) -> dict:
+    """The external address of every updated record type ('A' and/or 'AAAA'), or None where it is unknown."""
     try:
-        response = httpx.get('https://api.ipify.org?format=json', timeout=httpx.Timeout(15.0))
-        response.raise_for_status()
-        return response.json()['ip']
+        ips = discover_ips(sources_by_version=sources_by_version)
     except Exception as e:
         error(f"Error fetching external IP: {e}")
-        return None
+        ips = {}
+    return {RECORD_TYPES[version]: ips.get(version) for version in IP_VERSIONS}
+
+
+def get_record_key(host: str, record_type: str) -> str:
+    """Key of a record in the updatable hosts. A records are keyed by the bare host name, AAAA records by host#AAAA."""
+    return host if record_type == 'A' else f'{host}#{record_type}'
 
 
 # noinspection PyTypeChecker
-def get_record_id_by_name(cf: Cloudflare, zone_id: str, record_name: str) -> Tuple[
+def get_record_id_by_name(cf: Cloudflare, zone_id: str, record_name: str, record_type: Optional[str] = None) -> Tuple[
     Optional[str], Optional[str], Optional[bool]]:
     try:
-        record = cf.dns.records.list(zone_id=zone_id, name=record_name)
+        filters = {'type': record_type} if record_type else {}
+        with cloudflare_request_seconds.time(operation='lookup_record', zone=zone_id):
+            record = cf.dns.records.list(zone_id=zone_id, name=record_name, **filters)
         if record:
             if record.result_info.count == 0:
                 warn(
@@ -57,19 +97,215 @@ def get_record_id_by_name(cf: Cloudflare, zone_id: str, record_name: str) -> Tup
         return None, None, None
 
 
-def create_new_host_record(cf: Cloudflare, host: str, domain: str, zone_id: str) -> Optional[str]:
+def build_zone_record_index(cf: Cloudflare, zone_id: str) -> Optional[dict]:
+    """Fetch every A/AAAA record of a zone with paginated bulk list calls and index them by name.
+    Returns None if the zone could not be listed.
+    """
+    index: dict = {}
+    page = 1
+    try:
+        while True:
+            with cloudflare_request_seconds.time(operation='list_records', zone=zone_id):
+                records = cf.dns.records.list(zone_id=zone_id, page=page, per_page=RECORDS_PER_PAGE)
+            for record in records.result:
+                if record.type in INDEXED_RECORD_TYPES:
+                    index.setdefault(record.name.lower(), []).append(record)
+            # The API may cap the page size below RECORDS_PER_PAGE, so a short page is not the last one
+            total_pages = getattr(records.result_info, 'total_pages', None)
+            if not records.result or (total_pages is not None and page >= total_pages):
+                break
+            page += 1
+    except Exception as e:
+        client_manager.report_failure(e, cf)
+        error(f"Error listing DNS records for zone {zone_id}: {e}")
+        return None
+    return index
+
+
+def get_record_id_from_index(index: Optional[dict], zone_id: str, record_name: str,
+                             record_type: Optional[str] = None) -> Tuple[Optional[str], Optional[str], Optional[bool]]:
+    """Same as get_record_id_by_name, but resolves the record from a zone index instead of the API."""
+    if index is None:
+        return None, None, None
+    records = [record for record in index.get(record_name.lower(), [])
+               if record_type is None or record.type == record_type]
+    if not records:
+        warn(
+            f"No {record_type or 'DNS'} record found for {record_name} in zone {zone_id}.\nIf the ALLOW_CREATE_HOSTS is set to true, I'll try to create a new record.")
+        return NOT_FOUND, None, None
+    if len(records) > 1:
+        warn(f"Multiple DNS records found for {record_name} in zone {zone_id}. Using the first one.")
+    return records[0].id, records[0].type, records[0].proxied
+
+
+def find_indexed_record(index: Optional[dict], record_name: str, record_id: str):
+    """Find a record in a zone index by name and id."""
+    for record in (index or {}).get(record_name.lower(), []):
+        if record.id == record_id:
+            return record
+    return None
+
+
+def get_record_state(record) -> dict:
+    """The per-record cache kept in each updatable host entry, taken from a list response."""
+    modified_on = getattr(record, 'modified_on', None)
+    return {
+        'content': record.content,
+        'proxied': record.proxied,
+        'modified_on': modified_on.isoformat() if isinstance(modified_on, datetime) else modified_on
+    }
+
+
+@low_priority()
+def reconcile_record_state(cf: Cloudflare, actual_update_hosts: dict) -> int:
+    """
+    Refreshes the cached state of every record with one bulk listing per zone.
+
+    Records edited out of band get their real content back in the cache, so the next diff
+    repairs them. Records that were deleted and recreated are picked up by name.
+
+    Returns:
+        int: Number of records whose cached content was out of date
+    """
+    zone_ids = {host_info['zone_id'] for host_info in actual_update_hosts.values()}
+    zone_indexes = {zone_id: build_zone_record_index(cf, zone_id) for zone_id in zone_ids}
+    drifted = 0
+    for host_info in actual_update_hosts.values():
+        index = zone_indexes[host_info['zone_id']]
+        if index is not None and reconcile_host(index, host_info):
+            drifted += 1
+    return drifted
+
+
+def reconcile_host(index: dict, host_info: dict) -> bool:
+    """Refreshes the cached state of one record from a zone index. Returns True if its content was out of date."""
+    record = find_indexed_record(index, host_info['host'], host_info['record_id'])
+    if record is None:
+        same_type = [r for r in index.get(host_info['host'], []) if r.type == host_info['record_type']]
+        if not same_type:
+            warn(f"The DNS record for {host_info['host']} no longer exists in zone {host_info['zone_id']}.")
+            host_info['content'] = None
+            return False
+        record = same_type[0]
+        warn(f"The DNS record for {host_info['host']} was recreated with id {record.id}.")
+        host_info['record_id'] = record.id
+    state = get_record_state(record)
+    drifted = state['content'] != host_info.get('content')
+    if drifted:
+        warn(f"DNS record for {host_info['host']} was changed outside DynCFDNS: "
+             f"{host_info.get('content')} -> {state['content']}")
+    host_info.update(state)
+    return drifted
+
+
+@low_priority()
+def get_zone_nameservers(cf: Cloudflare, zone_id: str) -> list[tuple]:
+    """The (ip, port) of the authoritative nameservers Cloudflare assigned to a zone, or of DNS_PROBE_SERVERS.
+    Looked up once per zone.
+    """
+    if zone_id not in __zone_nameservers:
+        if DNS_PROBE_SERVERS:
+            servers = parse_servers(DNS_PROBE_SERVERS)
+        elif get_zone_name_servers(zone_id):
+            servers = resolve_nameservers(get_zone_name_servers(zone_id))
+        else:
+            try:
+                with cloudflare_request_seconds.time(operation='get_zone', zone=zone_id):
+                    zone = cf.zones.get(zone_id=zone_id)
+            except Exception as e:
+                client_manager.report_failure(e, cf)
+                error(f"Error fetching the nameservers of zone {zone_id}: {e}")
+                return []
+            servers = resolve_nameservers(zone.name_servers or [])
+        if not servers:
+            return []  # Looked up again at the next cycle
+        __zone_nameservers[zone_id] = servers
+    return __zone_nameservers[zone_id]
+
+
+def is_recently_modified(host_info: dict, now: datetime) -> bool:
+    """Whether the record was written less than PROPAGATION_GRACE seconds ago."""
+    try:
+        modified_on = datetime.fromisoformat(host_info.get('modified_on') or '')
+        return (now - modified_on).total_seconds() < PROPAGATION_GRACE
+    except (ValueError, TypeError):
+        return False
+
+
+@low_priority()
+def probe_record_state(group: HostGroup, external_ips: dict) -> int:
+    """
+    Checks the group's records against their zone's authoritative nameservers, instead of the API.
+
+    Only the records the cache says are up to date are probed: the others are about to be written
+    anyway. The ones served with another address are read through the API, to tell drift from a
+    nameserver that is merely behind. Records written less than PROPAGATION_GRACE seconds ago are
+    given time to propagate instead. Proxied records are skipped: the nameservers answer with Cloudflare's anycast addresses.
+
+    Returns:
+        int: Number of records read through the API
+    """
+    cf = client_manager.get_cloudflare(*group.credentials)
+    queries = {}
+    for key, host_info in group.hosts.items():
+        target = external_ips.get(host_info['record_type'])
+        if target and host_info.get('content') == target and not host_info.get('proxied'):
+            servers = get_zone_nameservers(cf, host_info['zone_id'])
+            if servers:
+                queries[key] = (servers, host_info['host'], host_info['record_type'])
+    answers = probe_records(queries)
+
+    now = datetime.now(timezone.utc)
+    suspects = []
+    for key, served in answers.items():
+        host_info = group.hosts[key]
+        target = external_ips[host_info['record_type']]
+        if served is None:
+            dns_probe_total.inc(outcome='no_answer')
+        elif target in served:
+            dns_probe_total.inc(outcome='match')
+        elif is_recently_modified(host_info, now):
+            dns_probe_total.inc(outcome='propagating')
+            info(f"The nameservers still serve {', '.join(served) or 'nothing'} for {host_info['host']}, "
+                 f"updated to {target} at {host_info['modified_on']}.")
+        else:
+            dns_probe_total.inc(outcome='mismatch')
+            suspects.append(host_info)
+    if answers:
+        info(f"Probed {len(answers)} records of host group '{group.name}' on the authoritative nameservers, "
+             f"{len(suspects)} to check through the API.")
+
+    record_ids = [host_info['record_id'] for host_info in suspects]
+    for host_info in suspects:
+        try:
+            with cloudflare_request_seconds.time(operation='lookup_record', zone=host_info['zone_id']):
+                records = cf.dns.records.list(zone_id=host_info['zone_id'], name=host_info['host'],
+                                              type=host_info['record_type'])
+        except Exception as e:
+            client_manager.report_failure(e, cf)
+            error(f"Error reading the DNS record for {host_info['host']}: {e}")
+            continue
+        reconcile_host({host_info['host']: list(records.result)}, host_info)
+    if any(host_info['record_id'] != record_id for host_info, record_id in zip(suspects, record_ids)):
+        persist_record_cache(group)
+    return len(suspects)
+
+
+def create_new_host_record(cf: Cloudflare, host: str, domain: str, zone_id: str, record_type: str = 'A',
+                           placeholder: Optional[str] = None) -> Optional[str]:
     try:
-        record = cf.dns.records.create(
-            zone_id=zone_id,
-            type='A',
-            name=f'{host}',
-            content=__previous_ip,  # Placeholder IP, will be updated later
-            proxied=False,
-            ttl=UPDATE_INTERVAL
-        )
+        with cloudflare_request_seconds.time(operation='create', zone=zone_id):
+            record = cf.dns.records.create(
+                zone_id=zone_id,
+                type=record_type,
+                name=f'{host}',
+                content=placeholder or __default_ips[record_type],  # Placeholder IP, will be updated later
+                proxied=False,
+                ttl=UPDATE_INTERVAL
+            )
 
         if record:
-            info(f"Created new DNS record for {host}.{domain}")
+            info(f"Created new {record_type} record for {host}.{domain}")
             return record.id
         else:
             error(f"Failed to create DNS record for {host}.{domain}")
@@ -79,128 +315,253 @@ def create_new_host_record(cf: Cloudflare, host: str, domain: str, zone_id: str)
         return None
 
 
-def update_cloudflare_dns_record(client: Cloudflare, host_record: dict) -> bool:
-    try:
-        record = client.dns.records.update(
-            dns_record_id=host_record['record_id'],
-            zone_id=host_record['zone_id'],
-            content=host_record['content'],
-            type=host_record['type'],
-            name=host_record['name']
-        )
-        info(f"Updated DNS record for {host_record['name']} to {host_record['content']}")
-        return record is not None and getattr(record, 'success', True)
-    except Exception as e:
-        error(f"Error updating DNS record for {host_record['name']}: {e}")
-        return False
-
-
+@low_priority()
 def assemble_hosts_records(api_token: str, api_key: str, api_email: str, host_list: list[str],
-                           allow_create_hosts: bool = False) -> dict:
-    cf = Cloudflare(api_token=api_token, api_email=api_email, api_key=api_key)
-    try:
-        zones = cf.zones.list()
-        if not zones.result:
-            error("No zones found in the provided account.")
-            return {}
-    except Exception as e:
-        error(f"Error fetching zones: {e}\nCheck the API credentials and permissions.")
+                           allow_create_hosts: bool = False, previous_ips: Optional[dict] = None) -> dict:
+    previous_ips = previous_ips or {}
+    cf = client_manager.get_cloudflare(api_token, api_key, api_email)
+    account_zones = resolve_zones(api_token, api_key, api_email, host_list)
+    if account_zones is None:
         return {}
-
-    zone_id_map = {zone.name: zone.id for zone in zones.result if zone.name in get_tlds(host_list)}
+    host_zones = {host: get_zone_for_host(host, account_zones) for host in host_list}
+    zone_id_map = {domain: account_zones[domain] for domain in set(host_zones.values()) if domain is not None}
 
     if not zone_id_map:
         error("No matching zones found for the provided host list.")
         return {}
 
+    # One paginated listing per zone instead of one lookup per host
+    zone_indexes = {domain: build_zone_record_index(cf, zone_id) for domain, zone_id in zone_id_map.items()}
+
     valid_updatable_hosts: dict = {}
     for host in host_list:
-        domain = get_domain(host)
-        if domain in zone_id_map:
-            record_id, record_type, proxied = get_record_id_by_name(cf, zone_id_map[domain], host)
-            if (record_id == NOT_FOUND) and allow_create_hosts:
-                record_id, record_type, proxied = create_new_host_record(cf, host, domain,
-                                                                         zone_id_map[domain]), 'A', False
-            if record_id:
-                valid_updatable_hosts[host] = {
-                    'host': host,
-                    'domain': domain,
-                    'zone_id': zone_id_map[domain],
-                    'record_type': record_type,
-                    'record_id': record_id,
-                    'proxied': proxied
-                }
-            else:
-                warn(f"No DNS record found for {host} in zone {zone_id_map[domain]}")
+        domain = host_zones[host]
+        if domain is not None:
+            # One independent entry per record type: an A and an AAAA record of the same host
+            for wanted_type in UPDATED_RECORD_TYPES:
+                key = get_record_key(host, wanted_type)
+                record_id, record_type, proxied = get_record_id_from_index(zone_indexes[domain], zone_id_map[domain],
+                                                                           host, wanted_type)
+                if (record_id == NOT_FOUND) and allow_create_hosts:
+                    record_id, record_type, proxied = create_new_host_record(
+                        cf, host, domain, zone_id_map[domain], wanted_type, previous_ips.get(wanted_type)
+                    ), wanted_type, False
+                if record_id and record_id != NOT_FOUND:
+                    valid_updatable_hosts[key] = {
+                        'host': host,
+                        'domain': domain,
+                        'zone_id': zone_id_map[domain],
+                        'record_type': record_type,
+                        'record_id': record_id,
+                        'proxied': proxied
+                    }
+                    record = find_indexed_record(zone_indexes[domain], host, record_id)
+                    if record is not None:
+                        valid_updatable_hosts[key].update(get_record_state(record))
+                    else:
+                        # Just created with the previous IP as placeholder content
+                        valid_updatable_hosts[key].update(content=previous_ips.get(record_type) or
+                                                          __default_ips[record_type], modified_on=None)
+                else:
+                    warn(f"No {wanted_type} record found for {host} in zone {zone_id_map[domain]}")
         else:
-            warn(f"Domain {domain} not found in Cloudflare zones for host {host}")
+            warn(f"No matching Cloudflare zone found for host {host}")
     return valid_updatable_hosts
 
 
-def get_domain(fqdn: str) -> str:
-    ext = tldextract.extract(fqdn)
-    return f"{ext.domain}.{ext.suffix}"
+def persist_record_cache(group: HostGroup):
+    """Saves the zone/record IDs of the group's hosts, e.g. after a record was found under a new ID."""
+    if group.record_cache_fingerprint and save_record_cache(group.record_cache_fingerprint, group.hosts,
+                                                            group.config_key(KEY_RECORD_CACHE)):
+        info(f"Saved the zone/record IDs of host group '{group.name}' to the record cache.")
 
 
-def get_tlds(host_list: list[str]) -> set:
-    return {get_domain(host) for host in host_list}
+@low_priority()
+def re_resolve_record(cf: Cloudflare, host_info: dict) -> bool:
+    """Looks a host's record up by name again, after Cloudflare said its cached ID does not exist."""
+    record_id, record_type, proxied = get_record_id_by_name(cf, host_info['zone_id'], host_info['host'],
+                                                            host_info['record_type'])
+    if not record_id or record_id == NOT_FOUND:
+        warn(f"The DNS record for {host_info['host']} no longer exists in zone {host_info['zone_id']}.")
+        return False
+    info(f"The DNS record for {host_info['host']} is now {record_id} (was {host_info['record_id']}).")
+    host_info.update(record_id=record_id, record_type=record_type, proxied=proxied, content=None, modified_on=None)
+    return True
 
 
-def update_dns_records(api_token: str, api_key: str, api_email: str, actual_update_hosts: dict) -> bool:
+def retry_missing_records(group: HostGroup, due_hosts: dict, host_records: list[dict],
+                          results: list[bool]) -> list[bool]:
     """
-    Updates DNS records in Cloudflare if the external IP has changed.
+    Re-resolves the records whose update failed with a 404, and updates the ones found again.
+
+    The record IDs come from a cache that can outlive the records, so they are only looked up
+    again when Cloudflare says they are gone, instead of at every startup.
+
+    Returns:
+        list[bool]: The results, with the ones of the retried records replaced
+    """
+    from cloudflare import NotFoundError
+    missing = [position for position, (host_record, success) in enumerate(zip(host_records, results))
+               if not success and isinstance(host_record.get('error'), NotFoundError)]
+    if not missing:
+        return results
+
+    cf = client_manager.get_cloudflare(*group.credentials)
+    host_infos = list(due_hosts.values())
+    resolved = [position for position in missing if re_resolve_record(cf, host_infos[position])]
+    if not resolved:
+        return results
+    persist_record_cache(group)
+
+    retried = []
+    for position in resolved:
+        host_info = host_infos[position]
+        host_records[position] = dict(host_records[position], record_id=host_info['record_id'],
+                                      type=host_info['record_type'], proxied=host_info['proxied'])
+        host_records[position].pop('error', None)
+        retried.append(host_records[position])
+    results = list(results)
+    for position, success in zip(resolved, update_records_concurrently(*group.credentials, retried,
+                                                                       UPDATE_CONCURRENCY)):
+        results[position] = success
+    return results
+
+
+def update_dns_records(group: HostGroup, external_ips: Optional[dict] = None) -> bool:
+    """
+    Updates the DNS records of a host group in Cloudflare if the external IP has changed.
 
     Args:
-        api_token (str): Cloudflare API token for authentication
-        api_key (str): Cloudflare API key for authentication
-        api_email (str): Email associated with Cloudflare account
-        actual_update_hosts (dict): Dictionary containing host records to update with structure:
+        group (HostGroup): The group to update, with its credentials and its records in group.hosts:
             {
-                'host_name': {
+                'host_name' or 'host_name#AAAA': {
                     'record_id': str,
                     'zone_id': str,
-                    'record_type': str,
+                    'record_type': str,  # 'A' or 'AAAA'
                     'host': str,
-                    'proxied': bool
+                    'proxied': bool,
+                    'content': str,  # cached record content, updated in place
+                    'modified_on': str
                 }
             }
+        external_ips (Optional[dict]): The address of each record type, as returned by get_external_ips.
+            When it is not given, it is discovered with the group's IP sources.
 
     Returns:
-        bool: True if all records were updated successfully, False otherwise
+        bool: True if every IP version was discovered and all records (except quarantined ones)
+            hold the external IP of their version, False otherwise
 
     Note:
-        The function checks if the external IP has changed before attempting any updates.
-        If the IP hasn't changed, it returns True without making any API calls.
+        The IPv4 and IPv6 addresses are discovered at the same time, and each record is compared
+        with the address of its own version: an IPv6 change never writes A records, and the reverse.
+        Only records whose cached content differs from the external IP are written. If none
+        differ, it returns True without making any API calls. Every RECONCILE_INTERVAL seconds
+        the cache is refreshed with one bulk listing per zone, to find records edited out of band.
+        With DNS_PROBE, every other cycle asks the zones' authoritative nameservers instead, and only
+        the records they serve with an unexpected address are read through the API.
+        Records that fail are retried in later cycles with exponential backoff (see RetryQueue).
+        Records that fail with a 404 are looked up by name again and retried right away.
+        Records are updated concurrently, with at most UPDATE_CONCURRENCY calls in flight, and
+        grouped into one batch call per zone when BATCH_UPDATES is enabled.
     """
-    global __previous_ip, __last_check, __last_update
-    result = False
-    external_ip = get_external_ip()
+    global __last_check, __last_update
+    actual_update_hosts = group.hosts
+    retry_queue = group.retry_queue
+    if external_ips is None:
+        external_ips = get_external_ips(get_sources_by_version(group.ip_source_names, group.ip_source_custom_url,
+                                                               group.ip_source_custom_url_v6))
     __last_check = datetime.now(timezone.utc)
-    if not external_ip:
+    publish_status(last_check=__last_check)
+    if not any(external_ips.values()):
         error("Could not retrieve external IP address.")
-        return result
-
-    if external_ip == __previous_ip:
-        info("External IP has not changed, skipping DNS update.")
-        return True
-
-    cf = Cloudflare(api_token=api_token, api_email=api_email, api_key=api_key)
-    results = []
-    for host_info in actual_update_hosts.values():
-        host_record = {
+        skipped_cycles_total.inc(reason='no_ip')
+        return False
+    for record_type, external_ip in external_ips.items():
+        if not external_ip:
+            error(f"Could not retrieve the external address for the {record_type} records. They are left as they are.")
+
+    if RECONCILE_INTERVAL > 0 and (group.last_reconcile is None or
+                                   time.monotonic() - group.last_reconcile >= RECONCILE_INTERVAL):
+        info(f"Reconciling cached DNS record state of host group '{group.name}' with Cloudflare.")
+        record_ids = {key: host_info['record_id'] for key, host_info in actual_update_hosts.items()}
+        reconcile_record_state(client_manager.get_cloudflare(*group.credentials), actual_update_hosts)
+        group.last_reconcile = time.monotonic()
+        if any(host_info['record_id'] != record_ids[key] for key, host_info in actual_update_hosts.items()):
+            persist_record_cache(group)
+    elif DNS_PROBE:
+        # Between two reconciliations, the nameservers tell which records need a look through the API
+        probe_record_state(group, external_ips)
+
+    # Only write the records whose cached content differs from the target IP of their type.
+    # Records whose IP could not be discovered keep their place in the retry queue.
+    unknown_hosts = {key for key, host_info in actual_update_hosts.items()
+                     if not external_ips.get(host_info['record_type'])}
+    drifted_hosts = {key: host_info for key, host_info in actual_update_hosts.items()
+                     if key not in unknown_hosts and host_info.get('content') != external_ips[host_info['record_type']]}
+    retry_queue.forget_except(set(drifted_hosts) | unknown_hosts)
+    if not drifted_hosts:
+        for record_type, external_ip in external_ips.items():
+            if not external_ip:
+                continue
+            if external_ip == group.previous_ips[record_type]:
+                info(f"External IP ({record_type}) has not changed, skipping DNS update of host group '{group.name}'.")
+            else:
+                info(f"All {record_type} records of host group '{group.name}' already point to {external_ip}.")
+                save_current_ip(group, external_ip, record_type)
+        skipped_cycles_total.inc(reason='unchanged')
+        return not unknown_hosts and all(external_ips.values())
+
+    # Hosts that failed recently wait for their backoff to expire
+    now = time.monotonic()
+    due_hosts = {key: host_info for key, host_info in drifted_hosts.items() if retry_queue.is_due(key, now)}
+    if len(due_hosts) < len(drifted_hosts):
+        info(f"{len(drifted_hosts) - len(due_hosts)} DNS records are waiting to be retried.")
+    if not due_hosts:
+        skipped_cycles_total.inc(reason='backoff')
+
+    host_records = []
+    for host_info in due_hosts.values():
+        host_records.append({
             'record_id': host_info['record_id'],
             'zone_id': host_info['zone_id'],
             'type': host_info['record_type'],
             'name': host_info['host'],
-            'content': external_ip,
+            'content': external_ips[host_info['record_type']],
             'proxied': host_info['proxied']
-        }
-        results.append(update_cloudflare_dns_record(cf, host_record))
-    if all(results):
-        save_current_ip(external_ip)
+        })
+    targets = ', '.join(f"{sum(1 for h in host_records if h['type'] == record_type)} {record_type} to {external_ip}"
+                        for record_type, external_ip in external_ips.items() if external_ip)
+    info(f"Updating {len(host_records)} of {len(actual_update_hosts)} DNS records of host group '{group.name}' "
+         f"({targets}).")
+    results = update_records_concurrently(*group.credentials, host_records, UPDATE_CONCURRENCY)
+    results = retry_missing_records(group, due_hosts, host_records, results)
+    updated_on = datetime.now(timezone.utc).isoformat()
+    for (key, host_info), host_record, success in zip(due_hosts.items(), host_records, results):
+        if success:
+            host_info.update(content=host_record['content'], modified_on=updated_on)
+            retry_queue.record_success(key)
+        else:
+            retry_queue.record_failure(key, get_retry_after(host_record.get('error')))
+    record_updates_total.inc(results.count(True))
+    record_failures_total.inc(results.count(False))
+    quarantined_records.set(len(retry_queue.quarantined_hosts()), group=group.name)
+
+    # Each IP version is saved on its own, and quarantined hosts must not hold up the rest of the fleet
+    all_updated = True
+    for record_type, external_ip in external_ips.items():
+        if not external_ip:
+            continue
+        pending = [key for key, host_info in actual_update_hosts.items()
+                   if host_info['record_type'] == record_type and host_info.get('content') != external_ip
+                   and not retry_queue.is_quarantined(key)]
+        if pending:
+            all_updated = False
+        else:
+            save_current_ip(group, external_ip, record_type)
+    if all_updated:
         __last_update = datetime.now(timezone.utc)
-        result = True
-    return result
+        publish_status(last_update=__last_update)
+    return all_updated and not unknown_hosts
 
 
 def get_env_var(name: str, default: Optional[str] = None) -> str:
@@ -215,25 +576,26 @@ def get_env_var(name: str, default: Optional[str] = None) -> str:
     return value
 
 
-def save_current_ip(ip: str):
-    """Save current IP as previous a file."""
-    global __previous_ip
-
-    if ip != __previous_ip:
-        if save_attribute_to_config(KEY_PREVIOUS_IP, ip):
-            __previous_ip = ip
-            info(f"Previous IP updated to {ip}")
+def save_current_ip(group: HostGroup, ip: str, record_type: str = 'A'):
+    """Save current IP, of the version held by record_type, as the group's previous IP in the config file."""
+    if ip != group.previous_ips[record_type]:
+        if save_attribute_to_config(group.config_key(__previous_ip_keys[record_type]), ip):
+            group.previous_ips[record_type] = ip
+            publish_status(**{__status_ip_fields[record_type]: ip})
+            info(f"Previous IP ({record_type}) of host group '{group.name}' updated to {ip}")
     else:
         info("IP has not changed, no update needed.")
 
 
-def load_previous_ip() -> str:
-    """Load previous IP from file."""
-    global __previous_ip, PREVIOUS_IP_FILENAME
-    __previous_ip = load_attribute_from_config(KEY_PREVIOUS_IP, '')
-    if not __previous_ip:
-        save_current_ip(__default_ip)
-    return __previous_ip
+def load_previous_ip(group: HostGroup) -> str:
+    """Load the group's previous IP of every updated record type from the config file. Returns the IPv4 one."""
+    for record_type in dict.fromkeys(('A',) + UPDATED_RECORD_TYPES):
+        group.previous_ips[record_type] = load_attribute_from_config(
+            group.config_key(__previous_ip_keys[record_type]), '')
+        if not group.previous_ips[record_type]:
+            save_current_ip(group, __default_ips[record_type], record_type)
+        publish_status(**{__status_ip_fields[record_type]: group.previous_ips[record_type]})
+    return group.previous_ips['A']
 
 
 def check_ip_file_folder():
@@ -244,98 +606,332 @@ def check_ip_file_folder():
         os.makedirs(log_dir, exist_ok=True)
     if not os.path.exists(PREVIOUS_IP_FILENAME):
         with open(PREVIOUS_IP_FILENAME, 'w') as f:
-            f.write(__default_ip)
-        info(f"Created {PREVIOUS_IP_FILENAME} with default IP {__default_ip}")
+            f.write(__default_ips['A'])
+        info(f"Created {PREVIOUS_IP_FILENAME} with default IP {__default_ips['A']}")
+
+
+def wake_updater():
+    """Ask the scheduler to check every host group right away instead of waiting for their interval."""
+    if __scheduler is not None:
+        __scheduler.wake()
+
+
+def push_external_ips(hostnames: list[str], ips: dict) -> dict:
+    """
+    Applies the external addresses reported by a router (dyndns2 /nic/update). Called by the API thread.
+
+    All the hosts of a group share its external address, so a push for one of them updates its
+    whole group. The groups with a new address are woken up: the pushes that come in during the
+    settle delay are merged into one cycle, and an address that is already current or pending
+    is not pushed again.
+
+    Args:
+        hostnames (list[str]): The hosts the router updates
+        ips (dict): The pushed address of each record type ('A' and/or 'AAAA')
+
+    Returns:
+        dict: hostname -> 'good' (the address is new), 'nochg' (already current or pending)
+            or 'nohost' (not a monitored host)
+    """
+    results = {}
+    woken = set()
+    with __pushed_ips_lock:
+        for hostname in hostnames:
+            groups = [group for group in __groups if hostname in group.host_list]
+            if not groups:
+                results[hostname] = 'nohost'
+                continue
+            for group in groups:
+                pending = __pushed_ips.setdefault(group.name, {})
+                for record_type, ip in ips.items():
+                    if record_type in UPDATED_RECORD_TYPES and \
+                            ip != pending.get(record_type, group.previous_ips.get(record_type)):
+                        pending[record_type] = ip
+                        woken.add(group.name)
+            # Another host of the same request may have pushed the new address of the group first
+            results[hostname] = 'good' if any(group.name in woken for group in groups) else 'nochg'
+    if woken and __scheduler is not None:
+        info(f"External address {', '.join(ips.values())} pushed for {', '.join(sorted(woken))}.")
+        __scheduler.wake(woken, reason='External address pushed')
+    return results
+
+
+def get_group_external_ips(group: HostGroup, discovered: dict) -> dict:
+    """
+    The external address of every record type of a group: the ones pushed since its last cycle,
+    the others discovered with its IP sources. `discovered` caches the discoveries of the cycle,
+    by IP source configuration. A group whose addresses were all pushed skips the discovery.
+    """
+    with __pushed_ips_lock:
+        pushed = __pushed_ips.pop(group.name, {})
+    if all(record_type in pushed for record_type in UPDATED_RECORD_TYPES):
+        return {record_type: pushed[record_type] for record_type in UPDATED_RECORD_TYPES}
+    sources_by_version = get_sources_by_version(group.ip_source_names, group.ip_source_custom_url,
+                                                group.ip_source_custom_url_v6)
+    if not any(sources_by_version.values()):
+        # Push only (IP_SOURCES=push): the last address pushed, and saved, is still the current one
+        saved = {record_type: ip for record_type, ip in group.previous_ips.items() if ip != __default_ips[record_type]}
+        return {record_type: pushed.get(record_type) or saved.get(record_type) for record_type in UPDATED_RECORD_TYPES}
+    if group.ip_source_key not in discovered:
+        discovered[group.ip_source_key] = get_external_ips(sources_by_version)
+    return {**discovered[group.ip_source_key], **pushed}
+
+
+def request_reload():
+    """Ask the scheduler to reload the host configuration before its next cycle."""
+    if __scheduler is not None:
+        __scheduler.request_reload()
+
+
+def __handle_sighup(signum, frame):
+    # The handler interrupts the main thread, which may be inside the scheduler's own wait. Setting
+    # the scheduler's Event from here could deadlock on its lock, so another thread does it.
+    threading.Thread(target=request_reload, name='ReloadRequest', daemon=True).start()
+
+
+def publish_monitored_hosts() -> tuple:
+    """Publishes the hosts of every group, e.g. after a reload."""
+    # A dual-stack host has two entries (host and host#AAAA), and a host may be in several groups, but is listed once
+    monitored_hosts = tuple(dict.fromkeys(host_info['host'] for group in __groups
+                                          for host_info in group.hosts.values()))
+    publish_status(hosts=monitored_hosts, check_interval=min((group.interval for group in __groups),
+                                                             default=UPDATE_INTERVAL))
+    host_count.set(len(monitored_hosts))
+    return monitored_hosts
+
+
+def run_groups(groups: list[HostGroup]):
+    """
+    Runs one update cycle of each group. Called by the scheduler with the groups that are due together.
+
+    The external IPs are discovered once per distinct IP source configuration, not once per group,
+    so N groups due at the same moment cost a single discovery.
+    """
+    info(f"Updating DNS records of {', '.join(group.name for group in groups)} at "
+         f"{time.strftime('%Y-%m-%d %H:%M:%S')}")
+    discovered: dict = {}
+    for group in groups:
+        try:
+            resolve_unresolved_hosts(group)
+            external_ips = get_group_external_ips(group, discovered)
+            with cycle_seconds.time():
+                success = update_dns_records(group, external_ips)
+
+            if success:
+                info(f"All DNS records of host group '{group.name}' updated successfully!")
+            else:
+                warn(f"Some DNS record updates of host group '{group.name}' failed.")
+        except Exception as e:
+            error(f"Unexpected error during DNS update of host group '{group.name}': {e}")
+    write_health_status(__last_check, min(group.interval for group in __groups or groups))
+
+
+def resolve_group(group: HostGroup) -> bool:
+    """Loads the group's previous IPs and resolves its records, from the record cache when possible.
+    Returns False if none of its hosts can be updated.
+    """
+    load_previous_ip(group)
+    group.record_cache_fingerprint = get_fingerprint(group.host_list, *group.credentials, UPDATED_RECORD_TYPES)
+    cached_hosts = load_record_cache(group.record_cache_fingerprint, key=group.config_key(KEY_RECORD_CACHE))
+    if cached_hosts:
+        # No lookups at all. Stale IDs are re-resolved when an update gets a 404 for them
+        info(f"Loaded the zone/record IDs of {len(cached_hosts)} records of host group '{group.name}' "
+             f"from the record cache.")
+        for host_info in cached_hosts.values():
+            host_info.update(content=group.previous_ips[host_info['record_type']], modified_on=None)
+        group.hosts = cached_hosts
+        # resolve_hosts tracks them otherwise
+        track_unresolved_hosts(group, group.host_list, group.hosts)
+    else:
+        group.hosts = resolve_hosts(group, group.host_list)
+        if group.hosts:
+            persist_record_cache(group)
+    # The record state was just read from Cloudflare, or is assumed to be the saved previous IP
+    group.last_reconcile = time.monotonic()
+    if not group.hosts:
+        error(f"No valid hosts found to monitor in host group '{group.name}'.")
+    return bool(group.hosts)
+
+
+def track_unresolved_hosts(group: HostGroup, host_list: list[str], resolved: dict):
+    """Puts the hosts without any record in the group's negative cache, and takes the others out of it."""
+    found = {host_info['host'] for host_info in resolved.values()}
+    for host in host_list:
+        if host in found:
+            group.unresolved.record_success(host)
+        else:
+            group.unresolved.record_failure(host)
+    unresolved = [host for host in host_list if host not in found]
+    if unresolved:
+        info(f"Host group '{group.name}': {', '.join(unresolved)} could not be resolved and will be looked up again "
+             f"later.")
+
+
+def resolve_hosts(group: HostGroup, host_list: list[str]) -> dict:
+    """Resolves the records of some hosts of a group, with one zone listing and one record listing per zone."""
+    resolved = assemble_hosts_records(*group.credentials, host_list, group.allow_create_hosts, group.previous_ips)
+    track_unresolved_hosts(group, host_list, resolved)
+    return resolved
+
+
+def set_group_hosts(group: HostGroup, host_list: list[str], hosts: dict):
+    """Swaps in the records of a group in one assignment, and saves them to the record cache."""
+    group.retry_queue.forget_except(set(hosts))
+    group.unresolved.forget_except(set(host_list))
+    group.host_list = list(host_list)
+    group.hosts = hosts
+    group.record_cache_fingerprint = get_fingerprint(group.host_list, *group.credentials, UPDATED_RECORD_TYPES)
+    persist_record_cache(group)
+
+
+def resolve_unresolved_hosts(group: HostGroup) -> int:
+    """Looks up the hosts of the negative cache whose backoff expired. Returns the number of records found."""
+    due = [host for host in group.unresolved.due_hosts() if host in group.host_list]
+    if not due:
+        return 0
+    info(f"Host group '{group.name}': looking up {', '.join(due)} again.")
+    resolved = resolve_hosts(group, due)
+    if resolved:
+        set_group_hosts(group, group.host_list, {**group.hosts, **resolved})
+        publish_monitored_hosts()
+    return len(resolved)
+
+
+def update_group_hosts(group: HostGroup, host_list: list[str]) -> bool:
+    """
+    Applies a new host list to a group without starting over: the records of the hosts that are
+    kept are reused as they are, only the added hosts are resolved, and the removed ones are dropped.
 
+    Returns:
+        bool: True if the host list changed
+    """
+    known = set(group.host_list)
+    added = [host for host in host_list if host not in known]
+    removed = known - set(host_list)
+    if not added and not removed:
+        return False
+    hosts = {key: host_info for key, host_info in group.hosts.items() if host_info['host'] not in removed}
+    resolved = resolve_hosts(group, added) if added else {}
+    set_group_hosts(group, host_list, {**hosts, **resolved})
+    info(f"Host group '{group.name}': {len(added)} hosts added ({len(resolved)} records found), "
+         f"{len(removed)} removed.")
+    return True
+
+
+def reload_groups(groups: list[HostGroup]) -> list[HostGroup]:
+    """
+    Reads the host configuration again and applies the differences to the running groups.
+    Called by the scheduler between two cycles, so no cycle ever sees a half-applied change.
 
-def get_updatable_hosts() -> dict:
-    """Thread-safe function to retrieve the updatable hosts dictionary.
+    Groups whose name and credentials are unchanged are updated in place (see update_group_hosts).
+    The other ones are resolved from scratch. If the configuration can't be read, nothing changes.
+    """
+    global __groups
+    info("Reloading the host configuration.")
+    try:
+        allow_create_hosts = get_env_var('ALLOW_CREATE_HOSTS', 'false').lower() in ['true', '1', 'yes']
+        configured = load_host_groups(allow_create_hosts)
+    except (ValueError, TypeError, EnvironmentError) as e:
+        error(f"Could not reload the host configuration, keeping the current one: {e}")
+        return groups
+
+    current = {group.name: group for group in groups}
+    reloaded = []
+    for config in configured:
+        group = current.get(config.name)
+        if group is None or group.credentials != config.credentials:
+            info(f"Host group '{config.name}' is {'new' if group is None else 'using new credentials'}.")
+            resolve_group(config)
+            reloaded.append(config)
+            continue
+        group.interval = config.interval
+        group.allow_create_hosts = config.allow_create_hosts
+        group.ip_source_names = config.ip_source_names
+        group.ip_source_custom_url = config.ip_source_custom_url
+        group.ip_source_custom_url_v6 = config.ip_source_custom_url_v6
+        update_group_hosts(group, config.host_list)
+        reloaded.append(group)
+    for name in current.keys() - {group.name for group in reloaded}:
+        info(f"Host group '{name}' was removed.")
+
+    __groups = reloaded
+    publish_monitored_hosts()
+    return reloaded
+
+
+def get_updatable_hosts() -> tuple:
+    """Lock-free function to retrieve the names of the updatable hosts.
     Used by the API to provide current host information.
     """
-    with thread_safe_lock:
-        global __updatable_hosts
-        return __updatable_hosts
+    return get_status().hosts
 
 
 def get_last_check() -> Optional[datetime]:
-    """Thread-safe function to retrieve the last check timestamp.
+    """Lock-free function to retrieve the last check timestamp.
     Used by the API to provide current health status.
     """
-    with thread_safe_lock:
-        global __last_check
-        return __last_check
+    return get_status().last_check
 
 
 def get_last_update() -> Optional[datetime]:
-    """Thread-safe function to retrieve the last update timestamp.
+    """Lock-free function to retrieve the last update timestamp.
     Used by the API to provide current update status.
     """
-    with thread_safe_lock:
-        global __last_update
-        return __last_update
+    return get_status().last_update
 
 
 def get_previous_ip() -> str:
-    """Thread-safe function to retrieve the last saved IP address.
+    """Lock-free function to retrieve the last saved IP address.
     Used by the API to provide current IP information.
     """
-    with thread_safe_lock:
-        global __previous_ip
-        return __previous_ip
+    return get_status().current_ip
 
 
 def main():
-    load_previous_ip()
-    global __updatable_hosts
+    global __groups, __scheduler
 
     try:
-        # Validate required environment variables
-        api_token = get_env_var('CLOUDFLARE_API_TOKEN')
-        api_key = get_env_var('CLOUDFLARE_API_KEY')
-        api_email = get_env_var('CLOUDFLARE_API_EMAIL')
         allow_create_hosts = get_env_var('ALLOW_CREATE_HOSTS', 'false').lower() in ['true', '1', 'yes']
-
-        host_list_str = os.getenv('HOST_LIST', '')
-        if not host_list_str:
-            error("HOST_LIST environment variable is not set.")
+        groups = load_host_groups(allow_create_hosts)
+        if not groups:
+            error("HOST_LIST environment variable is not set and no host groups are configured.")
             return
 
-        host_list = list({host.strip().lower() for host in host_list_str.split(',') if host.strip()})
-
-    except (ValueError, TypeError) as e:
+    except (ValueError, TypeError, EnvironmentError) as e:
         error(f"Configuration error: {e}")
         return
 
-    with thread_safe_lock:
-        __updatable_hosts = assemble_hosts_records(api_token, api_key, api_email, host_list, allow_create_hosts)
+    # Groups without any record yet are kept: their hosts are looked up again with backoff
+    resolved = [resolve_group(group) for group in groups]
+    __groups = groups
+    monitored_hosts = publish_monitored_hosts()
 
-    if not __updatable_hosts:
+    if not any(resolved):
         error("No valid hosts found to monitor. Exiting.")
         return
 
-    info(f"Starting DNS update service. Will check every {UPDATE_INTERVAL} seconds and update if required.")
-    with thread_safe_lock:
-        info(f"Monitoring hosts: {list(__updatable_hosts.keys())}")
+    __scheduler = GroupScheduler(__groups, run_groups, WAKE_SETTLE_DELAY, reload_groups)
 
-    while True:
-        try:
-            info(f"Updating DNS records at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            with thread_safe_lock:
-                success = update_dns_records(api_token, api_key, api_email, __updatable_hosts)
+    if PSL_REFRESH:
+        start_suffix_list_refresh()
 
-            if success:
-                info("All DNS records updated successfully!")
-            else:
-                warn("Some DNS record updates failed.")
-            with thread_safe_lock:
-                write_health_status(__last_check)
-            info(f"Next check in {UPDATE_INTERVAL} seconds...")
-            time.sleep(UPDATE_INTERVAL)
-
-        except KeyboardInterrupt:
-            warn("\nReceived interrupt signal. Shutting down...")
-            break
-        except Exception as e:
-            error(f"Unexpected error during DNS update: {e}")
-            info(f"Retrying in {UPDATE_INTERVAL} seconds...")
-            time.sleep(UPDATE_INTERVAL)
+    watcher = NetlinkWatcher(wake_updater) if NETLINK_WATCH else None
+    if watcher is not None:
+        watcher.start()
+
+    start_config_watch(request_reload)
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, __handle_sighup)
+
+    for group in __groups:
+        info(f"Host group '{group.name}' will be checked every {group.interval} seconds and updated if required.")
+    info(f"Starting DNS update service. Monitoring hosts: {list(monitored_hosts)} "
+         f"({', '.join(UPDATED_RECORD_TYPES)} records)")
+
+    try:
+        __scheduler.run_forever()
+    except KeyboardInterrupt:
+        warn("\nReceived interrupt signal. Shutting down...")
+        if watcher is not None:
+            watcher.stop()
+        client_manager.close()
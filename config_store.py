@@ -0,0 +1,138 @@
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+from singleton_logger import warn, error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes
+    fcntl = None
+
+FLUSH_DELAY: float = 1.0  # Seconds the writes are gathered before they are flushed in a single rewrite
+
+
+class ConfigStore:
+    """The JSON config file, kept in memory.
+
+    Reads are served from memory: the file is only parsed again when another process replaced it.
+    Writes are applied in memory right away and flushed by a background thread, FLUSH_DELAY seconds
+    after the first one, so a burst of writes (e.g. the previous IP and the record cache of every
+    host group) costs a single rewrite. A flush never leaves a half-written file: it writes a
+    temporary file, syncs it and renames it over the config file. It holds an exclusive lock on
+    a `.lock` file next to it, and merges its changes into the file's current content, so the
+    updater and the API worker processes can share the file.
+    """
+
+    def __init__(self, path: str, flush_delay: float = FLUSH_DELAY):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._data: dict = {}
+        self._dirty: dict = {}  # Attributes set since the last flush
+        self._signature: Optional[tuple] = None  # (inode, size, mtime) of the file the data was read from
+        self._lock = threading.RLock()
+        self._flush_requested = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _read(self) -> dict:
+        signature = self._stat()
+        if signature == self._signature:
+            return self._data
+        data = {}
+        if signature is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("not a JSON object")
+            except (ValueError, IOError) as e:
+                data = {}
+                warn(f"Could not read the config file: {e}")
+                if isinstance(e, ValueError):  # Includes json.JSONDecodeError
+                    try:
+                        # Kept aside, instead of being overwritten by the next flush
+                        os.replace(self.path, f"{self.path}.corrupt")
+                        signature = None
+                    except OSError:
+                        pass
+        self._signature = signature
+        # Set and not flushed yet: newer than the file
+        self._data = {**data, **self._dirty}
+        return self._data
+
+    def get(self, attribute: str, default: Any = '') -> Any:
+        with self._lock:
+            return copy.deepcopy(self._read().get(attribute, default))
+
+    def set(self, attribute: str, value: Any):
+        with self._lock:
+            value = copy.deepcopy(value)
+            self._read()[attribute] = value
+            self._dirty[attribute] = value
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_later, name='ConfigFlush', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+        self._flush_requested.set()
+
+    def _flush_later(self):
+        while True:
+            self._flush_requested.wait()
+            time.sleep(self.flush_delay)  # The writes that come in meanwhile are flushed together
+            self._flush_requested.clear()
+            self.flush()
+
+    def flush(self) -> bool:
+        """Writes the pending changes now. Returns False if they could not be written (they are kept for the next try)."""
+        with self._lock:
+            if not self._dirty:
+                return True
+            try:
+                directory = os.path.dirname(self.path) or '.'
+                os.makedirs(directory, exist_ok=True)
+                with open(f"{self.path}.lock", 'a') as lock_file:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    # Another process may have written its own attributes since this one read the file
+                    data = self._read()
+                    fd, temp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=directory)
+                    try:
+                        with os.fdopen(fd, 'w') as f:
+                            json.dump(data, f, indent=2)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(temp_path, self.path)
+                    except BaseException:
+                        os.unlink(temp_path)
+                        raise
+                    self.__sync_directory(directory)
+                    self._signature = self._stat()
+                self._dirty.clear()
+                return True
+            except OSError as e:
+                error(f"Could not save the config file: {e}")
+                return False
+
+    @staticmethod
+    def __sync_directory(directory: str):
+        # Makes the rename itself durable
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return  # Not possible on Windows
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,212 @@
+import asyncio
+import ipaddress
+import random
+import socket
+import struct
+from typing import Optional
+
+from globals import DNS_PROBE_TIMEOUT
+from http_clients import client_manager
+from singleton_logger import warn
+
+DNS_PORT: int = 53
+QUERY_TYPES: dict = {'A': 1, 'AAAA': 28}
+CLASS_IN: int = 1
+FLAG_RESPONSE: int = 0x8000
+FLAG_AUTHORITATIVE: int = 0x0400
+FLAG_TRUNCATED: int = 0x0200
+RCODE_NXDOMAIN: int = 3
+MAX_IN_FLIGHT: int = 256  # Queries waiting for an answer at the same time
+
+HEADER = struct.Struct('!HHHHHH')   # id, flags, questions, answers, authority records, additional records
+QUESTION = struct.Struct('!HH')     # type, class
+RECORD = struct.Struct('!HHIH')     # type, class, ttl, data length
+
+
+def encode_name(name: str) -> bytes:
+    encoded = b''
+    for label in name.rstrip('.').split('.'):
+        raw = label.encode('idna')
+        if not 0 < len(raw) < 64:
+            raise ValueError(f"Invalid DNS name: {name}")
+        encoded += bytes((len(raw),)) + raw
+    return encoded + b'\x00'
+
+
+def read_name(data: bytes, offset: int) -> tuple[str, int]:
+    """Reads a possibly compressed name. Returns the name and the offset right after it."""
+    labels = []
+    end = None
+    for _ in range(128):  # Bounds the pointer chain of a malicious answer
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+        elif length == 0:
+            return '.'.join(labels).lower(), end if end is not None else offset + 1
+        else:
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+            offset += 1 + length
+    raise ValueError("DNS name compression loop")
+
+
+def build_query(query_id: int, name: str, record_type: str) -> bytes:
+    # Recursion is not requested: the nameservers must answer from their own zone data
+    return HEADER.pack(query_id, 0, 1, 0, 0, 0) + encode_name(name) + QUESTION.pack(QUERY_TYPES[record_type], CLASS_IN)
+
+
+def parse_response(data: bytes) -> tuple[int, str, int, Optional[set]]:
+    """
+    Parses the answer to a query made by build_query.
+
+    Returns:
+        tuple: The query id, name and type, and the addresses served: an empty set if the name or
+            the type does not exist, or None if the server gave no authoritative answer
+    """
+    query_id, flags, questions, answers, _, _ = HEADER.unpack_from(data)
+    if not flags & FLAG_RESPONSE or questions != 1:
+        raise ValueError("Not a response to a single question")
+    name, offset = read_name(data, HEADER.size)
+    query_type, _ = QUESTION.unpack_from(data, offset)
+    offset += QUESTION.size
+    rcode = flags & 0x000F
+    if not flags & FLAG_AUTHORITATIVE or flags & FLAG_TRUNCATED or rcode not in (0, RCODE_NXDOMAIN):
+        return query_id, name, query_type, None
+    addresses: set = set()
+    if rcode == RCODE_NXDOMAIN:
+        return query_id, name, query_type, addresses
+    for _ in range(answers):
+        _, offset = read_name(data, offset)
+        record_type, record_class, _, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if record_type == query_type and record_class == CLASS_IN and record_type in QUERY_TYPES.values():
+            addresses.add(str(ipaddress.ip_address(data[offset:offset + length])))
+        offset += length
+    return query_id, name, query_type, addresses
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    """Hands each answer to the query waiting for it. Anything else is dropped."""
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: dict = {}  # (server ip, port, query id) -> (future, name, query type)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        try:
+            query_id, name, query_type, addresses = parse_response(data)
+        except (ValueError, IndexError, struct.error):
+            return
+        entry = self.pending.get((addr[0], addr[1], query_id))
+        # The question must match too, so a stray or forged datagram can't answer for another name
+        if entry is not None and not entry[0].done() and entry[1:] == (name, query_type):
+            entry[0].set_result(addresses)
+
+    def error_received(self, exc):
+        pass  # E.g. ICMP port unreachable. The query just times out.
+
+
+def __family(server: tuple) -> int:
+    return socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+
+
+async def __query(endpoints: dict, semaphore: asyncio.Semaphore, servers: list[tuple], name: str,
+                  record_type: str, timeout: float) -> Optional[set]:
+    """Asks the servers one after the other, until one of them gives an authoritative answer."""
+    loop = asyncio.get_running_loop()
+    name = name.lower().rstrip('.')
+    query_type = QUERY_TYPES[record_type]
+    async with semaphore:
+        for server in servers:
+            protocol = endpoints.get(__family(server))
+            if protocol is None:
+                continue  # E.g. no IPv6 on this host
+            query_id = random.randrange(65536)
+            while (server[0], server[1], query_id) in protocol.pending:
+                query_id = random.randrange(65536)
+            future = loop.create_future()
+            key = (server[0], server[1], query_id)
+            protocol.pending[key] = (future, name, query_type)
+            try:
+                protocol.transport.sendto(build_query(query_id, name, record_type), server)
+                addresses = await asyncio.wait_for(future, timeout)
+            except (asyncio.TimeoutError, OSError):
+                continue
+            finally:
+                del protocol.pending[key]
+            if addresses is not None:
+                return addresses
+    return None
+
+
+async def __probe_all(queries: dict, timeout: float) -> dict:
+    loop = asyncio.get_running_loop()
+    endpoints: dict = {}  # One socket per address family, shared by all the queries
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+    keys = list(queries)
+    try:
+        for family in {__family(server) for servers, _, _ in queries.values() for server in servers}:
+            try:
+                _, endpoints[family] = await loop.create_datagram_endpoint(
+                    _ProbeProtocol, local_addr=('::' if family == socket.AF_INET6 else '0.0.0.0', 0), family=family)
+            except OSError as e:
+                warn(f"Could not open a DNS probe socket for {'IPv6' if family == socket.AF_INET6 else 'IPv4'}: {e}")
+        results = await asyncio.gather(*(__query(endpoints, semaphore, *queries[key], timeout) for key in keys))
+    finally:
+        for protocol in endpoints.values():
+            protocol.transport.close()
+    return dict(zip(keys, results))
+
+
+def probe_records(queries: dict, timeout: float = DNS_PROBE_TIMEOUT) -> dict:
+    """
+    Asks authoritative nameservers for many records at once, over UDP.
+
+    Every query is sent right away (at most MAX_IN_FLIGHT wait for an answer at the same time), so
+    probing N records takes about one round trip instead of N. A server that does not answer within
+    `timeout` seconds, or answers without authority, is replaced by the next one of the list.
+
+    Args:
+        queries (dict): key -> (servers as (ip, port) tuples, name, record type 'A' or 'AAAA')
+        timeout (float): Seconds to wait for each server
+
+    Returns:
+        dict: key -> the addresses served (empty if the record does not exist), or None if no server answered
+    """
+    if not queries:
+        return {}
+    return client_manager.run(__probe_all(queries, timeout))
+
+
+def parse_servers(servers: list[str]) -> list[tuple]:
+    """Turns host, host:port, [ipv6]:port or a bare IPv6 address into (ip, port) tuples."""
+    parsed = []
+    for server in servers:
+        host, port = server, DNS_PORT
+        if server.startswith('['):
+            host, _, rest = server[1:].partition(']')
+            port = int(rest[1:]) if rest.startswith(':') else DNS_PORT
+        elif server.count(':') == 1:
+            host, port = server.split(':')[0], int(server.split(':')[1])
+        parsed.extend(resolve_nameservers([host], port))
+    return parsed
+
+
+def resolve_nameservers(names: list[str], port: int = DNS_PORT) -> list[tuple]:
+    """The (ip, port) of each nameserver, IPv4 first. Names that don't resolve are left out."""
+    servers = []
+    for name in names:
+        try:
+            infos = socket.getaddrinfo(name, port, type=socket.SOCK_DGRAM)
+        except socket.gaierror as e:
+            warn(f"Could not resolve the nameserver {name}: {e}")
+            continue
+        for family, _, _, _, address in sorted(infos, key=lambda info: info[0] != socket.AF_INET):
+            server = (ipaddress.ip_address(address[0]).compressed, address[1])
+            if server not in servers:
+                servers.append(server)
+    return servers
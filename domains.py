@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from globals import ZONE_MATCH, ZONE_MATCH_SUFFIX, PSL_REFRESH_INTERVAL
+from singleton_logger import info, warn
+
+PSL_URL: str = 'https://publicsuffix.org/list/public_suffix_list.dat'
+PSL_CACHE_DIR: str = './config/psl'
+PSL_CACHE_FILE: str = os.path.join(PSL_CACHE_DIR, 'public_suffix_list.dat')
+PSL_MARKER: str = '===BEGIN ICANN DOMAINS==='  # Present in every genuine copy of the list
+
+__extractor = None
+__extractor_lock: threading.Lock = threading.Lock()
+
+
+def __build_extractor():
+    """An extractor that never touches the network.
+
+    It uses the suffix list last downloaded by the refresh thread, or else the snapshot bundled
+    with the installed tldextract version.
+    """
+    import tldextract
+    if os.path.exists(PSL_CACHE_FILE):
+        info(f"Using the public suffix list downloaded on "
+             f"{time.strftime('%Y-%m-%d', time.gmtime(os.path.getmtime(PSL_CACHE_FILE)))}.")
+        return tldextract.TLDExtract(cache_dir=None, fallback_to_snapshot=True,
+                                     suffix_list_urls=(f'file://{os.path.abspath(PSL_CACHE_FILE)}',))
+    info(f"Using the public suffix list bundled with tldextract {tldextract.__version__}.")
+    return tldextract.TLDExtract(cache_dir=None, suffix_list_urls=())
+
+
+def __get_extractor():
+    global __extractor
+    with __extractor_lock:
+        if __extractor is None:
+            __extractor = __build_extractor()
+        return __extractor
+
+
+@lru_cache(maxsize=65536)
+def get_domain(fqdn: str) -> str:
+    """The registrable domain of a host name, e.g. example.co.uk for home.example.co.uk. Memoized."""
+    ext = __get_extractor()(fqdn)
+    return f"{ext.domain}.{ext.suffix}"
+
+
+def get_zone_for_host(host: str, zone_names: Iterable[str], mode: str = ZONE_MATCH) -> Optional[str]:
+    """
+    Finds the zone a host belongs to.
+
+    In 'psl' mode the zone must be the registrable domain of the host. In 'suffix' mode it is the
+    longest zone name the host ends with, so delegated subzones (lab.example.com) and suffixes
+    missing from the public suffix list are matched too.
+
+    Returns:
+        Optional[str]: The zone name, or None if no zone matches
+    """
+    if mode == ZONE_MATCH_SUFFIX:
+        host = host.lower().rstrip('.')
+        labels = host.split('.')
+        zone_names = zone_names if isinstance(zone_names, (set, frozenset, dict)) else set(zone_names)
+        # Walk from the longest candidate to the shortest: the first hit is the longest match
+        for start in range(len(labels)):
+            candidate = '.'.join(labels[start:])
+            if candidate in zone_names:
+                return candidate
+        return None
+    domain = get_domain(host)
+    return domain if domain in zone_names else None
+
+
+def refresh_suffix_list() -> bool:
+    """Downloads the public suffix list into PSL_CACHE_DIR and switches get_domain over to it."""
+    global __extractor
+    import httpx
+    try:
+        response = httpx.get(PSL_URL, timeout=30, follow_redirects=True)
+        response.raise_for_status()
+        if PSL_MARKER not in response.text:
+            warn("The downloaded public suffix list does not look valid. Keeping the current one.")
+            return False
+        os.makedirs(PSL_CACHE_DIR, exist_ok=True)
+        temp_path = f"{PSL_CACHE_FILE}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        os.replace(temp_path, PSL_CACHE_FILE)
+    except (httpx.HTTPError, OSError) as e:
+        warn(f"Could not refresh the public suffix list, keeping the current one: {e}")
+        return False
+
+    extractor = __build_extractor()
+    with __extractor_lock:
+        __extractor = extractor
+    get_domain.cache_clear()
+    info("The public suffix list was refreshed.")
+    return True
+
+
+def __refresh_loop(interval: int):
+    while True:
+        age = time.time() - os.path.getmtime(PSL_CACHE_FILE) if os.path.exists(PSL_CACHE_FILE) else interval
+        if age >= interval:
+            # A failed download is tried again within the hour
+            age = 0 if refresh_suffix_list() else max(0, interval - 3600)
+        time.sleep(max(60.0, interval - age))
+
+
+def start_suffix_list_refresh(interval: int = PSL_REFRESH_INTERVAL) -> threading.Thread:
+    """Keeps the downloaded suffix list at most `interval` seconds old, from a daemon thread.
+    Lookups never wait for it: until a download succeeds, the previous list is used.
+    """
+    thread = threading.Thread(target=__refresh_loop, args=(interval,), name='SuffixListRefresh', daemon=True)
+    thread.start()
+    return thread
@@ -1,10 +1,21 @@
 import os
 from secrets import token_bytes
 from base64 import b64encode
+from config_store import ConfigStore
 from singleton_logger import info, warn, error
 
 
 __CONFIG_PATH     : str = './config/.config.json'
+MODE_RACE         : str = 'race'
+MODE_QUORUM       : str = 'quorum'
+ZONE_MATCH_PSL    : str = 'psl'
+ZONE_MATCH_SUFFIX : str = 'suffix'
+ZONE_LOOKUP_NAME  : str = 'name'
+ZONE_LOOKUP_ALL   : str = 'all'
+API_MODE_THREAD   : str = 'thread'
+API_MODE_PROCESS  : str = 'process'
+RECORD_TYPES      : dict = {4: 'A', 6: 'AAAA'}  # The record type that holds each IP version
+__config_store    : ConfigStore = ConfigStore(__CONFIG_PATH)
 
 
 def get_update_interval() -> int:
@@ -15,6 +26,202 @@ def get_update_interval() -> int:
         warn("Expected UPDATE_INTERVAL to be a valid integer. Using default value of 2 minutes.")
         return 120
 
+def get_update_concurrency() -> int:
+    """Get the maximum number of concurrent Cloudflare update calls from environment variable or default to 16."""
+    try:
+        return max(1, int(os.getenv('UPDATE_CONCURRENCY', '16')))
+    except ValueError:
+        warn("Expected UPDATE_CONCURRENCY to be a valid integer. Using default value of 16.")
+        return 16
+
+def get_batch_updates() -> bool:
+    """Get whether record updates should use the per-zone batch endpoint. Defaults to true."""
+    return os.getenv('BATCH_UPDATES', 'true').lower() in ['true', '1', 'yes']
+
+def get_batch_size() -> int:
+    """Get the maximum number of records sent in one batch call, or default to 200 (the Free plan limit)."""
+    try:
+        return max(1, int(os.getenv('BATCH_SIZE', '200')))
+    except ValueError:
+        warn("Expected BATCH_SIZE to be a valid integer. Using default value of 200.")
+        return 200
+
+def get_ip_discovery_mode() -> str:
+    """Get the IP discovery mode ('race' or 'quorum') from environment variable or default to 'race'."""
+    mode = os.getenv('IP_DISCOVERY_MODE', MODE_RACE).lower()
+    if mode not in (MODE_RACE, MODE_QUORUM):
+        warn(f"Unknown IP_DISCOVERY_MODE '{mode}'. Using '{MODE_RACE}'.")
+        return MODE_RACE
+    return mode
+
+def get_ip_quorum() -> int:
+    """Get how many IP sources must agree in quorum mode, or default to 2."""
+    try:
+        return max(1, int(os.getenv('IP_QUORUM', '2')))
+    except ValueError:
+        warn("Expected IP_QUORUM to be a valid integer. Using default value of 2.")
+        return 2
+
+def get_ip_source_timeout() -> float:
+    """Get the timeout, in seconds, of each IP source request, or default to 5 seconds."""
+    try:
+        return max(0.1, float(os.getenv('IP_SOURCE_TIMEOUT', '5')))
+    except ValueError:
+        warn("Expected IP_SOURCE_TIMEOUT to be a valid number. Using default value of 5 seconds.")
+        return 5.0
+
+def get_ip_hedge_delay() -> float:
+    """Get how long, in seconds, race mode waits for a source before also asking the next one. Defaults to 1 second."""
+    try:
+        return max(0.0, float(os.getenv('IP_HEDGE_DELAY', '1')))
+    except ValueError:
+        warn("Expected IP_HEDGE_DELAY to be a valid number. Using default value of 1 second.")
+        return 1.0
+
+def get_ip_source_names() -> list[str]:
+    """Get the IP sources to use, in order of preference. The custom source is added when its URL is set."""
+    custom = os.getenv('IP_SOURCE_CUSTOM_URL') or os.getenv('IP_SOURCE_CUSTOM_URL_V6')
+    default = 'ipify,icanhazip,cloudflare' + (',custom' if custom else '')
+    return [name.strip().lower() for name in os.getenv('IP_SOURCES', default).split(',') if name.strip()]
+
+def get_ip_versions() -> list[int]:
+    """Get the IP versions to keep up to date: 4 (A records), 6 (AAAA records) or both. Defaults to 4."""
+    versions = []
+    for version in os.getenv('IP_VERSIONS', '4').replace('v', '').split(','):
+        if version.strip() in ('4', '6') and int(version) not in versions:
+            versions.append(int(version))
+        elif version.strip():
+            warn(f"Unknown IP version '{version.strip()}' in IP_VERSIONS. Ignoring it.")
+    return versions or [4]
+
+def get_netlink_watch() -> bool:
+    """Get whether netlink address/route events should trigger an immediate check. Defaults to false."""
+    return os.getenv('NETLINK_WATCH', 'false').lower() in ['true', '1', 'yes']
+
+def get_reconcile_interval() -> int:
+    """Get how often, in seconds, the cached record state is checked against Cloudflare. 0 disables it. Defaults to 1 hour."""
+    try:
+        return max(0, int(os.getenv('RECONCILE_INTERVAL', '3600')))
+    except ValueError:
+        warn("Expected RECONCILE_INTERVAL to be a valid integer. Using default value of 1 hour.")
+        return 3600
+
+def get_retry_base_delay() -> float:
+    """Get the delay, in seconds, before the first retry of a failed record update, or default to 5 seconds."""
+    try:
+        return max(1.0, float(os.getenv('RETRY_BASE_DELAY', '5')))
+    except ValueError:
+        warn("Expected RETRY_BASE_DELAY to be a valid number. Using default value of 5 seconds.")
+        return 5.0
+
+def get_retry_max_delay() -> float:
+    """Get the longest delay, in seconds, between retries of a failed record update, or default to 10 minutes."""
+    try:
+        return max(1.0, float(os.getenv('RETRY_MAX_DELAY', '600')))
+    except ValueError:
+        warn("Expected RETRY_MAX_DELAY to be a valid number. Using default value of 10 minutes.")
+        return 600.0
+
+def get_quarantine_after() -> int:
+    """Get how many failures in a row put a host in quarantine, or default to 5."""
+    try:
+        return max(1, int(os.getenv('QUARANTINE_AFTER', '5')))
+    except ValueError:
+        warn("Expected QUARANTINE_AFTER to be a valid integer. Using default value of 5.")
+        return 5
+
+def get_quarantine_duration() -> float:
+    """Get how long, in seconds, a quarantined host is left alone, or default to 1 hour."""
+    try:
+        return max(1.0, float(os.getenv('QUARANTINE_DURATION', '3600')))
+    except ValueError:
+        warn("Expected QUARANTINE_DURATION to be a valid number. Using default value of 1 hour.")
+        return 3600.0
+
+def get_record_cache_ttl() -> int:
+    """Get how long, in seconds, the persisted zone/record IDs are trusted at startup. 0 disables the cache. Defaults to 1 day."""
+    try:
+        return max(0, int(os.getenv('RECORD_CACHE_TTL', '86400')))
+    except ValueError:
+        warn("Expected RECORD_CACHE_TTL to be a valid integer. Using default value of 1 day.")
+        return 86400
+
+def get_zone_match() -> str:
+    """Get how hosts are matched to zones ('psl' or 'suffix') from environment variable or default to 'psl'."""
+    mode = os.getenv('ZONE_MATCH', ZONE_MATCH_PSL).lower()
+    if mode not in (ZONE_MATCH_PSL, ZONE_MATCH_SUFFIX):
+        warn(f"Unknown ZONE_MATCH '{mode}'. Using '{ZONE_MATCH_PSL}'.")
+        return ZONE_MATCH_PSL
+    return mode
+
+def get_zone_lookup() -> str:
+    """Get how zones are found ('name': one filtered query per domain, 'all': list every zone of the account), or default to 'name'."""
+    mode = os.getenv('ZONE_LOOKUP', ZONE_LOOKUP_NAME).lower()
+    if mode not in (ZONE_LOOKUP_NAME, ZONE_LOOKUP_ALL):
+        warn(f"Unknown ZONE_LOOKUP '{mode}'. Using '{ZONE_LOOKUP_NAME}'.")
+        return ZONE_LOOKUP_NAME
+    return mode
+
+def get_psl_refresh() -> bool:
+    """Get whether the public suffix list should be refreshed from the network in the background. Defaults to false."""
+    return os.getenv('PSL_REFRESH', 'false').lower() in ['true', '1', 'yes']
+
+def get_psl_refresh_interval() -> int:
+    """Get the age, in seconds, at which the downloaded public suffix list is refreshed, or default to 7 days."""
+    try:
+        return max(3600, int(os.getenv('PSL_REFRESH_INTERVAL', '604800')))
+    except ValueError:
+        warn("Expected PSL_REFRESH_INTERVAL to be a valid integer. Using default value of 7 days.")
+        return 604800
+
+def get_rate_limit_requests() -> int:
+    """Get how many Cloudflare API requests may be sent per RATE_LIMIT_PERIOD, or default to 1200 (Cloudflare's global limit)."""
+    try:
+        return max(2, int(os.getenv('RATE_LIMIT_REQUESTS', '1200')))
+    except ValueError:
+        warn("Expected RATE_LIMIT_REQUESTS to be a valid integer. Using default value of 1200.")
+        return 1200
+
+def get_rate_limit_period() -> float:
+    """Get the period, in seconds, of the Cloudflare API rate limit, or default to 5 minutes."""
+    try:
+        return max(1.0, float(os.getenv('RATE_LIMIT_PERIOD', '300')))
+    except ValueError:
+        warn("Expected RATE_LIMIT_PERIOD to be a valid number. Using default value of 5 minutes.")
+        return 300.0
+
+def get_rate_limit_reserve() -> int:
+    """Get how many requests of the budget are kept for record updates, out of reach of lookups and reconciliation. Defaults to 200."""
+    try:
+        return max(0, int(os.getenv('RATE_LIMIT_RESERVE', '200')))
+    except ValueError:
+        warn("Expected RATE_LIMIT_RESERVE to be a valid integer. Using default value of 200.")
+        return 200
+
+def get_dns_probe() -> bool:
+    """Get whether the records should be checked against the authoritative nameservers every cycle. Defaults to false."""
+    return os.getenv('DNS_PROBE', 'false').lower() in ['true', '1', 'yes']
+
+def get_dns_probe_servers() -> list[str]:
+    """Get the nameservers (host[:port]) to probe instead of the ones Cloudflare assigned to each zone, or default to none."""
+    return [server.strip() for server in os.getenv('DNS_PROBE_SERVERS', '').split(',') if server.strip()]
+
+def get_dns_probe_timeout() -> float:
+    """Get how long, in seconds, a nameserver has to answer a probe, or default to 1 second."""
+    try:
+        return max(0.1, float(os.getenv('DNS_PROBE_TIMEOUT', '1')))
+    except ValueError:
+        warn("Expected DNS_PROBE_TIMEOUT to be a valid number. Using default value of 1 second.")
+        return 1.0
+
+def get_config_watch_interval() -> int:
+    """Get how often, in seconds, HOST_LIST_FILE and HOST_GROUPS_FILE are checked for changes. 0 disables it. Defaults to 30 seconds."""
+    try:
+        return max(0, int(os.getenv('CONFIG_WATCH_INTERVAL', '30')))
+    except ValueError:
+        warn("Expected CONFIG_WATCH_INTERVAL to be a valid integer. Using default value of 30 seconds.")
+        return 30
+
 def get_api_port() -> int:
     """Get the API port from environment variable or default to 5000."""
     try:
@@ -23,6 +230,22 @@ def get_api_port() -> int:
         warn("API_PORT is set but is not a valid integer. Disabling API.")
         return 0
 
+def get_api_mode() -> str:
+    """Get where the API runs ('thread': in the updater process, 'process': in its own processes), or default to 'thread'."""
+    mode = os.getenv('API_MODE', API_MODE_THREAD).lower()
+    if mode not in (API_MODE_THREAD, API_MODE_PROCESS):
+        warn(f"Unknown API_MODE '{mode}'. Using '{API_MODE_THREAD}'.")
+        return API_MODE_THREAD
+    return mode
+
+def get_api_workers() -> int:
+    """Get the number of API worker processes in 'process' mode, or default to 1."""
+    try:
+        return max(1, int(os.getenv('API_WORKERS', '1')))
+    except ValueError:
+        warn("Expected API_WORKERS to be a valid integer. Using default value of 1.")
+        return 1
+
 def get_api_token() -> str:
     """Get the API token from environment variable, config file, or generate a new one."""
     # Check if API is disabled
@@ -32,7 +255,9 @@ def get_api_token() -> str:
     # Try to get token from environment variable
     token = os.getenv('API_TOKEN', '')
     if token:
-        save_attribute_to_config('api_token', token)
+        # Every API worker process reads this too: only the first one writes the config file
+        if load_attribute_from_config('api_token') != token:
+            save_attribute_to_config('api_token', token)
         return token
 
     # Try to get token from config file
@@ -44,53 +269,63 @@ def get_api_token() -> str:
     random_bytes = token_bytes(32)
     token = b64encode(random_bytes).decode('utf-8')
     save_attribute_to_config('api_token', token)
+    # Right away: if the service stopped before the background flush, the next start would make another one
+    flush_config()
     info(f"\nThe internal API is enabled, but a valid token could not be found.\nA new API token has been generated:\n\n{'*'*60}\n{token:^60}\n{'*'*60}\n\n")
 
     return token
 
-def save_attribute_to_config(attribute: str, value: str) -> bool:
-    """Save an attribute to the config file."""
-    import json
-    try:
-        # Ensure config directory exists
-        os.makedirs(os.path.dirname(__CONFIG_PATH), exist_ok=True)
-
-        # Load existing config or create new one
-        config = {}
-        if os.path.exists(__CONFIG_PATH):
-            try:
-                with open(__CONFIG_PATH, 'r') as f:
-                    config = json.load(f)
-            except json.JSONDecodeError:
-                config = {}
-
-        # Update config with new attribute
-        config[attribute] = value
-
-        # Save config
-        with open(__CONFIG_PATH, 'w') as f:
-            json.dump(config, f, indent=2)
-        return True
-    except IOError as e:
-        warn(f"Could not save {attribute} to config file: {e}")
-        return False
-
-def load_attribute_from_config(attribute: str, default: str='') -> str:
-    """Load an attribute from the config file."""
-    import json
-    try:
-        if os.path.exists(__CONFIG_PATH):
-            with open(__CONFIG_PATH, 'r') as f:
-                config = json.load(f)
-                return config.get(attribute, '')
-    except (json.JSONDecodeError, IOError) as e:
-        warn(f"Could not read {attribute} from config file: {e}")
-    return default
-
-
-API_PORT        : int = get_api_port()
-UPDATE_INTERVAL : int = get_update_interval()
-API_TOKEN       : str = get_api_token()
-NOT_FOUND       : str = 'Not Found'
-KEY_PREVIOUS_IP : str = 'previous_ip'
+def save_attribute_to_config(attribute: str, value: str | dict) -> bool:
+    """Save an attribute to the config file. The file is rewritten in the background (see ConfigStore)."""
+    __config_store.set(attribute, value)
+    return True
+
+def load_attribute_from_config(attribute: str, default: str | dict='') -> str | dict:
+    """Load an attribute from the config file. Served from memory, unless another process changed the file."""
+    return __config_store.get(attribute, default)
+
+def flush_config() -> bool:
+    """Write the attributes saved so far to the config file now, instead of in the background."""
+    return __config_store.flush()
+
 
+API_PORT                : int = get_api_port()
+API_MODE                : str = get_api_mode()
+API_WORKERS             : int = get_api_workers()
+UPDATE_INTERVAL         : int = get_update_interval()
+UPDATE_CONCURRENCY      : int = get_update_concurrency()
+BATCH_UPDATES           : bool = get_batch_updates()
+BATCH_SIZE              : int = get_batch_size()
+IP_DISCOVERY_MODE       : str = get_ip_discovery_mode()
+IP_QUORUM               : int = get_ip_quorum()
+IP_SOURCE_TIMEOUT       : float = get_ip_source_timeout()
+IP_HEDGE_DELAY          : float = get_ip_hedge_delay()
+IP_SOURCE_NAMES         : list = get_ip_source_names()
+IP_SOURCE_CUSTOM_URL    : str = os.getenv('IP_SOURCE_CUSTOM_URL', '')
+IP_SOURCE_CUSTOM_URL_V6 : str = os.getenv('IP_SOURCE_CUSTOM_URL_V6', '')
+IP_VERSIONS             : list = get_ip_versions()
+NETLINK_WATCH           : bool = get_netlink_watch()
+RECONCILE_INTERVAL      : int = get_reconcile_interval()
+RETRY_BASE_DELAY        : float = get_retry_base_delay()
+RETRY_MAX_DELAY         : float = get_retry_max_delay()
+QUARANTINE_AFTER        : int = get_quarantine_after()
+QUARANTINE_DURATION     : float = get_quarantine_duration()
+RECORD_CACHE_TTL        : int = get_record_cache_ttl()
+ZONE_MATCH              : str = get_zone_match()
+ZONE_LOOKUP             : str = get_zone_lookup()
+PSL_REFRESH             : bool = get_psl_refresh()
+PSL_REFRESH_INTERVAL    : int = get_psl_refresh_interval()
+RATE_LIMIT_REQUESTS     : int = get_rate_limit_requests()
+RATE_LIMIT_PERIOD       : float = get_rate_limit_period()
+RATE_LIMIT_RESERVE      : int = get_rate_limit_reserve()
+DNS_PROBE               : bool = get_dns_probe()
+DNS_PROBE_SERVERS       : list = get_dns_probe_servers()
+DNS_PROBE_TIMEOUT       : float = get_dns_probe_timeout()
+HOST_LIST_FILE          : str = os.getenv('HOST_LIST_FILE', '')
+HOST_GROUPS_FILE        : str = os.getenv('HOST_GROUPS_FILE', './config/host_groups.json')
+CONFIG_WATCH_INTERVAL   : int = get_config_watch_interval()
+API_TOKEN               : str = get_api_token()
+NOT_FOUND               : str = 'Not Found'
+KEY_PREVIOUS_IP         : str = 'previous_ip'
+KEY_PREVIOUS_IPV6       : str = 'previous_ipv6'
+KEY_RECORD_CACHE        : str = 'record_cache'
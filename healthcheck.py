@@ -1,27 +1,40 @@
 #!/usr/bin/env python3
 
+# Docker runs this file as a probe every few seconds, so it only imports the standard library:
+# importing globals would read (and may rewrite) the config file, and singleton_logger opens the log file.
 import os
 import sys
 import json
 from datetime import datetime, timedelta, timezone
-from globals import UPDATE_INTERVAL
 import tempfile
-from singleton_logger import error
 
 HEALTH_FILE: str = "dyncfdns_health.json"
 HEALTH_FILE_FULL_PATH: str = os.path.join(tempfile.gettempdir(), HEALTH_FILE)
 
-def write_health_status(last_check: datetime = datetime.now(timezone.utc)) -> bool:
-    """Write current timestamp to health file."""
+
+def get_update_interval() -> int:
+    """Same as globals.get_update_interval, without its imports and warnings."""
+    try:
+        return max(1, int(os.getenv('UPDATE_INTERVAL', '120')))
+    except ValueError:
+        return 120
+
+def write_health_status(last_check: datetime = datetime.now(timezone.utc), interval: int = 0) -> bool:
+    """Write current timestamp to health file, with the longest expected gap between checks."""
     try:
         health_data = {
             'last_check': last_check.isoformat(),
+            'interval': interval or get_update_interval(),
             'status': 'running'
         }
-        with open(HEALTH_FILE_FULL_PATH, 'w') as f:
+        # Written aside and renamed, so the probe never reads a half-written file
+        temp_path = f"{HEALTH_FILE_FULL_PATH}.tmp"
+        with open(temp_path, 'w') as f:
             json.dump(health_data, f)
+        os.replace(temp_path, HEALTH_FILE_FULL_PATH)
         return True
     except Exception as e:
+        from singleton_logger import error
         error(f"Failed to write health status to file:\n{e}")
         return False
 
@@ -37,13 +50,14 @@ def check_health():
         last_check = datetime.fromisoformat(health_data['last_check'])
         current_time = datetime.now(timezone.utc)
 
-        if current_time - last_check > timedelta(seconds=UPDATE_INTERVAL+15): # Allow a 15-second grace period
+        interval = health_data.get('interval') or get_update_interval()
+        if current_time - last_check > timedelta(seconds=interval+15): # Allow a 15-second grace period
             return False
 
         return True
 
     except Exception as e:
-        error(f"Failed to write health status to file:\n{e}")
+        print(f"Failed to read health status from file:\n{e}", file=sys.stderr)
         return False
 
 
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from globals import (UPDATE_INTERVAL, RETRY_BASE_DELAY, RETRY_MAX_DELAY, QUARANTINE_AFTER, QUARANTINE_DURATION,
+                     HOST_LIST_FILE, HOST_GROUPS_FILE, CONFIG_WATCH_INTERVAL)
+from retry_queue import RetryQueue
+from singleton_logger import info, warn, error
+
+DEFAULT_GROUP: str = 'default'  # The group built from HOST_LIST. It keeps the config keys used before groups existed
+CREDENTIAL_VARS: dict = {'api_token': 'CLOUDFLARE_API_TOKEN', 'api_key': 'CLOUDFLARE_API_KEY',
+                         'api_email': 'CLOUDFLARE_API_EMAIL'}
+UNRESOLVED_BASE_DELAY: float = 60.0    # First wait before a host that could not be resolved is looked up again
+UNRESOLVED_MAX_DELAY: float = 3600.0   # Longest wait between lookups of a host that could not be resolved
+
+
+@dataclass(eq=False)
+class HostGroup:
+    """A set of hosts checked on their own schedule, with their own credentials and IP sources.
+
+    Besides its configuration, a group holds the state of its update cycle: the resolved records,
+    the retry queue, the last saved IPs and the time of the last reconciliation.
+    """
+    name: str
+    host_list: list
+    api_token: str
+    api_key: str
+    api_email: str
+    interval: int = UPDATE_INTERVAL
+    allow_create_hosts: bool = False
+    ip_source_names: Optional[tuple] = None  # None means the global IP_SOURCES
+    ip_source_custom_url: str = ''
+    ip_source_custom_url_v6: str = ''
+
+    hosts: dict = field(default_factory=dict)  # The updatable records, see cfupdater.update_dns_records
+    previous_ips: dict = field(default_factory=lambda: {'A': '', 'AAAA': ''})
+    retry_queue: RetryQueue = field(default_factory=lambda: RetryQueue(RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                                                                       QUARANTINE_AFTER, QUARANTINE_DURATION))
+    # Negative cache of the hosts without a zone or record, looked up again with backoff instead of at every reload
+    unresolved: RetryQueue = field(default_factory=lambda: RetryQueue(UNRESOLVED_BASE_DELAY, UNRESOLVED_MAX_DELAY,
+                                                                      QUARANTINE_AFTER, QUARANTINE_DURATION))
+    last_reconcile: Optional[float] = None  # time.monotonic() of the last reconciliation pass
+    record_cache_fingerprint: str = ''  # The record cache is only saved when it is set
+
+    @property
+    def credentials(self) -> tuple:
+        return self.api_token, self.api_key, self.api_email
+
+    @property
+    def ip_source_key(self) -> tuple:
+        """Groups with the same key ask the same IP sources, so they can share one discovery."""
+        if self.ip_source_names is None:
+            return ()
+        return self.ip_source_names, self.ip_source_custom_url, self.ip_source_custom_url_v6
+
+    def config_key(self, key: str) -> str:
+        """The config file key of a per-group attribute, e.g. previous_ip:critical."""
+        return key if self.name == DEFAULT_GROUP else f'{key}:{self.name}'
+
+
+def parse_host_list(value) -> list[str]:
+    """Accepts a comma-separated string or a list. Hosts are lowercased and deduplicated."""
+    hosts = value.split(',') if isinstance(value, str) else value
+    return list(dict.fromkeys(host.strip().lower() for host in hosts if host.strip()))
+
+
+def read_host_list_file(path: str = HOST_LIST_FILE) -> list[str]:
+    """Reads hosts separated by commas or new lines. Everything after a # is a comment."""
+    if not path:
+        return []
+    try:
+        with open(path, 'r') as f:
+            return parse_host_list(','.join(line.split('#', 1)[0] for line in f))
+    except IOError as e:
+        raise ValueError(f"Could not read the host list from {path}: {e}")
+
+
+def __get_credential(entry: dict, name: str) -> str:
+    """A credential is given inline (api_token), by the name of the variable that holds it
+    (api_token_env), or else taken from the global CLOUDFLARE_API_* variable.
+    """
+    value = entry.get(name) or os.getenv(entry.get(f'{name}_env', ''), '') or os.getenv(CREDENTIAL_VARS[name], '')
+    if not value:
+        raise EnvironmentError(f"{CREDENTIAL_VARS[name]} is required (host group '{entry.get('name')}')")
+    return value
+
+
+def __parse_group(entry: dict, allow_create_hosts: bool) -> HostGroup:
+    name = str(entry.get('name', '')).strip()
+    if not name:
+        raise ValueError("Every host group needs a name")
+    interval = int(entry.get('interval', UPDATE_INTERVAL))
+    if interval < 1:
+        raise ValueError(f"The interval of host group '{name}' must be at least 1 second")
+    ip_sources = entry.get('ip_sources')
+    return HostGroup(
+        name=name,
+        host_list=parse_host_list(entry.get('hosts', [])),
+        api_token=__get_credential(entry, 'api_token'),
+        api_key=__get_credential(entry, 'api_key'),
+        api_email=__get_credential(entry, 'api_email'),
+        interval=interval,
+        allow_create_hosts=bool(entry.get('allow_create_hosts', allow_create_hosts)),
+        ip_source_names=None if ip_sources is None else tuple(parse_host_list(ip_sources)),
+        ip_source_custom_url=entry.get('ip_source_custom_url', ''),
+        ip_source_custom_url_v6=entry.get('ip_source_custom_url_v6', '')
+    )
+
+
+def load_host_groups(allow_create_hosts: bool = False, path: str = HOST_GROUPS_FILE) -> list[HostGroup]:
+    """
+    Builds the host groups from HOST_LIST and the HOST_GROUPS_FILE.
+
+    HOST_LIST and HOST_LIST_FILE become the 'default' group, checked every UPDATE_INTERVAL seconds
+    with the global credentials and IP sources. The groups file holds a JSON list of further groups:
+        [{"name": "critical", "hosts": ["vpn.example.com"], "interval": 15,
+          "ip_sources": ["custom"], "ip_source_custom_url": "http://router/ip",
+          "api_token_env": "CRITICAL_CF_TOKEN"}]
+
+    Raises:
+        EnvironmentError: If a group has no credentials
+        ValueError: If the file is malformed or two groups have the same name
+    """
+    groups = []
+    host_list = parse_host_list(parse_host_list(os.getenv('HOST_LIST', '')) + read_host_list_file())
+    if host_list:
+        groups.append(__parse_group({'name': DEFAULT_GROUP, 'hosts': host_list}, allow_create_hosts))
+
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            raise ValueError(f"Could not read the host groups from {path}: {e}")
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError(f"{path} must hold a list of host groups")
+        groups.extend(__parse_group(entry, allow_create_hosts) for entry in entries)
+        info(f"Loaded {len(entries)} host groups from {path}.")
+
+    names = [group.name for group in groups]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate host group names: {', '.join(sorted(duplicates))}")
+    for group in groups:
+        if not group.host_list:
+            error(f"Host group '{group.name}' has no hosts.")
+    return [group for group in groups if group.host_list]
+
+
+def __config_mtimes(paths: list[str]) -> tuple:
+    return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+
+def __watch_loop(paths: list[str], interval: int, on_change: Callable[[], None]):
+    mtimes = __config_mtimes(paths)
+    while True:
+        time.sleep(interval)
+        try:
+            current = __config_mtimes(paths)
+        except OSError as e:
+            warn(f"Could not check the host configuration files for changes: {e}")
+            continue
+        if current != mtimes:
+            mtimes = current
+            info("The host configuration changed on disk.")
+            on_change()
+
+
+def start_config_watch(on_change: Callable[[], None], interval: int = CONFIG_WATCH_INTERVAL) -> Optional[threading.Thread]:
+    """Calls on_change, from a daemon thread, when HOST_LIST_FILE or HOST_GROUPS_FILE is created, changed or
+    deleted. The files are polled every `interval` seconds, which works on every platform and volume type.
+    """
+    paths = [path for path in (HOST_LIST_FILE, HOST_GROUPS_FILE) if path]
+    if interval <= 0 or not paths:
+        return None
+    thread = threading.Thread(target=__watch_loop, args=(paths, interval, on_change), name='ConfigWatch', daemon=True)
+    thread.start()
+    return thread
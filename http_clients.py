@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import threading
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import httpx
+
+if TYPE_CHECKING:
+    # The SDK takes a while to import, so it is only loaded when the first Cloudflare client is built
+    from cloudflare import Cloudflare, AsyncCloudflare
+
+from globals import UPDATE_INTERVAL, UPDATE_CONCURRENCY, IP_SOURCE_TIMEOUT
+from metrics import observe_rate_limit, observe_rate_limit_async, throttle_request, throttle_request_async
+from singleton_logger import info, warn
+
+IP_UPSTREAM: str = 'ip'  # Key of the IP discovery client among the upstreams. Cloudflare ones are credentials.
+
+# HTTP/2 needs the optional h2 package (installed by httpx[http2]); fall back to HTTP/1.1 without it
+HTTP2_AVAILABLE: bool = importlib.util.find_spec('h2') is not None
+
+
+def _describe(upstream) -> str:
+    return 'IP discovery' if upstream == IP_UPSTREAM else 'Cloudflare'
+
+
+class ClientManager:
+    """Owns the long-lived, keep-alive HTTP clients used to reach Cloudflare and the IP discovery service.
+
+    The clients are reused across update cycles, so each cycle does not pay a new TCP + TLS handshake.
+    There is one pair of Cloudflare clients per set of credentials (one per host group at most).
+    Each upstream (the IP discovery client, or the Cloudflare clients of one set of credentials) is
+    rebuilt on its own, when a connection failure is reported for one of its clients.
+    Async clients are bound to the event loop they were first used on, so this class also owns a
+    background event loop that every async call is run on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._ip_client: Optional[httpx.AsyncClient] = None
+        self._cloudflare: dict[Tuple[str, str, str], Cloudflare] = {}
+        self._async_cloudflare: dict[Tuple[str, str, str], AsyncCloudflare] = {}
+        self._stale_upstreams: set = set()  # IP_UPSTREAM and/or credentials whose clients must be rebuilt
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        # Keep idle connections a bit longer than one update interval, so the next cycle can reuse them
+        return httpx.Limits(max_connections=max(10, UPDATE_CONCURRENCY),
+                            max_keepalive_connections=max(10, UPDATE_CONCURRENCY),
+                            keepalive_expiry=UPDATE_INTERVAL + 30)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='ClientManagerLoop',
+                                                     daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def run(self, coro):
+        """Run a coroutine on the manager's event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def _rebuild_if_needed(self, upstream):
+        """Must be called with the lock held."""
+        if upstream in self._stale_upstreams:
+            info(f"Rebuilding the HTTP clients of {_describe(upstream)}.")
+            self._close_clients(upstream)
+            self._stale_upstreams.discard(upstream)
+
+    def _close_async(self, client):
+        if client is not None and self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose() if isinstance(client, httpx.AsyncClient)
+                                             else client.close(), self._loop).result()
+
+    def _close_clients(self, upstream=None):
+        """Close the clients of one upstream, or of all of them. Must be called with the lock held."""
+        if upstream is None or upstream == IP_UPSTREAM:
+            self._close_async(self._ip_client)
+            self._ip_client = None
+        for credentials in list(self._cloudflare) if upstream is None else [upstream]:
+            if credentials in self._cloudflare:
+                self._cloudflare.pop(credentials).close()
+        for credentials in list(self._async_cloudflare) if upstream is None else [upstream]:
+            self._close_async(self._async_cloudflare.pop(credentials, None))
+
+    def get_async_ip_client(self) -> httpx.AsyncClient:
+        """Get the pooled async client used for IP discovery.
+        The client must only be used on the manager's event loop (see run()).
+        """
+        with self._lock:
+            self._rebuild_if_needed(IP_UPSTREAM)
+            if self._ip_client is None:
+                self._ip_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                                    timeout=httpx.Timeout(IP_SOURCE_TIMEOUT))
+            return self._ip_client
+
+    def get_cloudflare(self, api_token: str, api_key: str, api_email: str) -> Cloudflare:
+        """Get the pooled synchronous Cloudflare client for the given credentials."""
+        credentials = (api_token, api_key, api_email)
+        with self._lock:
+            self._rebuild_if_needed(credentials)
+            if credentials not in self._cloudflare:
+                from cloudflare import Cloudflare, DefaultHttpxClient
+                self._cloudflare[credentials] = Cloudflare(api_token=api_token, api_email=api_email, api_key=api_key,
+                                              http_client=DefaultHttpxClient(
+                                                  http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                                  event_hooks={'request': [throttle_request],
+                                                               'response': [observe_rate_limit]}))
+            return self._cloudflare[credentials]
+
+    def get_async_cloudflare(self, api_token: str, api_key: str, api_email: str) -> AsyncCloudflare:
+        """Get the pooled async Cloudflare client for the given credentials.
+        The client must only be used on the manager's event loop (see run()).
+        """
+        credentials = (api_token, api_key, api_email)
+        with self._lock:
+            self._rebuild_if_needed(credentials)
+            if credentials not in self._async_cloudflare:
+                from cloudflare import AsyncCloudflare, DefaultAsyncHttpxClient
+                self._async_cloudflare[credentials] = AsyncCloudflare(api_token=api_token, api_email=api_email, api_key=api_key,
+                                                         http_client=DefaultAsyncHttpxClient(
+                                                             http2=HTTP2_AVAILABLE, limits=self._limits(),
+                                                             event_hooks={'request': [throttle_request_async],
+                                                                          'response': [observe_rate_limit_async]}))
+            return self._async_cloudflare[credentials]
+
+    def _find_upstream(self, client):
+        # No lock: called from the manager's loop too, while another thread may hold it waiting on that loop
+        if client is not None and client is self._ip_client:
+            return IP_UPSTREAM
+        for clients in (self._cloudflare, self._async_cloudflare):
+            for credentials, pooled_client in list(clients.items()):
+                if pooled_client is client:
+                    return credentials
+        return None
+
+    def report_failure(self, exception: BaseException, client):
+        """Flag the upstream of the given client for a rebuild if the exception means a connection was lost.
+        Only the clients of that upstream are rebuilt. Timeouts only mean the upstream is slow, so they don't
+        trigger a rebuild, nor do failures of clients that were already replaced.
+        """
+        from cloudflare import APIConnectionError, APITimeoutError
+        if (isinstance(exception, (httpx.TransportError, APIConnectionError))
+                and not isinstance(exception, (httpx.TimeoutException, APITimeoutError))):
+            upstream = self._find_upstream(client)
+            if upstream is not None:
+                warn(f"Connection failure reported, the HTTP clients of {_describe(upstream)} "
+                     f"will be rebuilt: {exception}")
+                self._stale_upstreams.add(upstream)
+
+    def close(self):
+        """Close every client and stop the event loop."""
+        with self._lock:
+            self._close_clients()
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop_thread.join(timeout=5)
+                self._loop.close()
+            self._loop = None
+            self._loop_thread = None
+
+
+# Global client manager instance
+client_manager = ClientManager()
@@ -0,0 +1,235 @@
+import asyncio
+import ipaddress
+import json
+import time
+from typing import Callable, Optional
+
+import httpx
+
+from globals import (IP_DISCOVERY_MODE, IP_QUORUM, IP_SOURCE_TIMEOUT, IP_HEDGE_DELAY, IP_SOURCE_NAMES,
+                     IP_SOURCE_CUSTOM_URL, IP_SOURCE_CUSTOM_URL_V6, IP_VERSIONS, MODE_QUORUM)
+from http_clients import client_manager
+from metrics import ip_discovery_seconds
+from singleton_logger import warn, error
+
+HEALTH_SMOOTHING: float = 0.3  # Weight of the newest sample in the latency moving average
+
+
+def parse_json_ip(text: str) -> str:
+    return json.loads(text)['ip']
+
+
+def parse_plain_ip(text: str) -> str:
+    return text.strip()
+
+
+def parse_trace_ip(text: str) -> str:
+    """Parse the key=value body returned by Cloudflare's /cdn-cgi/trace."""
+    for line in text.splitlines():
+        key, _, value = line.partition('=')
+        if key.strip() == 'ip':
+            return value.strip()
+    raise ValueError("No ip= line found in trace response")
+
+
+def parse_any_ip(text: str) -> str:
+    """Used for custom URLs: accepts {"ip": ...} JSON, a trace body or a plain-text address."""
+    for parser in (parse_json_ip, parse_trace_ip):
+        try:
+            return parser(text)
+        except (ValueError, KeyError, TypeError):
+            pass
+    return parse_plain_ip(text)
+
+
+class IPSource:
+    """A single IP discovery provider for one IP version, with its own timeout and health score."""
+
+    def __init__(self, name: str, url: str, parser: Callable[[str], str], timeout: float, version: int = 4):
+        self.name = name
+        self.url = url
+        self.version = version
+        self.parser = parser
+        self.timeout = timeout
+        self.latency = 0.0  # Moving average, in seconds. Failures count as twice the timeout.
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def score(self) -> float:
+        """Lower is better. Slow or failing sources drift to the back of the queue."""
+        return self.latency
+
+    def _record(self, sample: float):
+        self.latency = (1 - HEALTH_SMOOTHING) * self.latency + HEALTH_SMOOTHING * sample
+
+    async def fetch(self, client: httpx.AsyncClient) -> Optional[str]:
+        started = time.monotonic()
+        try:
+            response = await client.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            address = ipaddress.ip_address(self.parser(response.text))
+            if address.version != self.version:
+                raise ValueError(f"Expected an IPv{self.version} address, got {address}")
+            ip = str(address)
+        except asyncio.CancelledError:
+            # Lost the race: the time spent so far is a lower bound of this source's latency
+            self._record(time.monotonic() - started)
+            ip_discovery_seconds.observe(time.monotonic() - started, provider=self.name, outcome='cancelled')
+            raise
+        except Exception as e:
+            client_manager.report_failure(e, client)
+            self.failures += 1
+            self._record(self.timeout * 2)
+            ip_discovery_seconds.observe(time.monotonic() - started, provider=self.name, outcome='failure')
+            warn(f"IP source {self.name} failed: {e!r}")
+            return None
+        self.successes += 1
+        self._record(time.monotonic() - started)
+        ip_discovery_seconds.observe(time.monotonic() - started, provider=self.name, outcome='success')
+        return ip
+
+
+# The hosts only have an A (or only an AAAA) record, so each request is made over the wanted IP version
+BUILTIN_SOURCES: dict = {
+    'ipify': ('https://api.ipify.org?format=json', parse_json_ip),
+    'icanhazip': ('https://ipv4.icanhazip.com', parse_plain_ip),
+    'cloudflare': ('https://1.1.1.1/cdn-cgi/trace', parse_trace_ip),
+}
+BUILTIN_SOURCES_V6: dict = {
+    'ipify': ('https://api6.ipify.org?format=json', parse_json_ip),
+    'icanhazip': ('https://ipv6.icanhazip.com', parse_plain_ip),
+    'cloudflare': ('https://[2606:4700:4700::1111]/cdn-cgi/trace', parse_trace_ip),
+}
+
+
+def build_sources(names: list[str], custom_url: str, timeout: float, version: int = 4) -> list[IPSource]:
+    """Build the configured sources of one IP version, in order. 'custom' refers to custom_url."""
+    builtin_sources = BUILTIN_SOURCES_V6 if version == 6 else BUILTIN_SOURCES
+    suffix = '-v6' if version == 6 else ''  # Keeps the provider labels of the metrics apart
+    sources = []
+    for name in names:
+        if name == 'custom':
+            if custom_url:
+                sources.append(IPSource(name + suffix, custom_url, parse_any_ip, timeout, version))
+            else:
+                warn(f"IP source 'custom' is listed but IP_SOURCE_CUSTOM_URL{'_V6' if version == 6 else ''} "
+                     f"is not set. Ignoring it for IPv{version}.")
+        elif name == 'push':
+            pass  # Not polled: the addresses pushed to /nic/update are applied as they come
+        elif name in builtin_sources:
+            url, parser = builtin_sources[name]
+            sources.append(IPSource(name + suffix, url, parser, timeout, version))
+        else:
+            warn(f"Unknown IP source '{name}'. Ignoring it.")
+    return sources
+
+
+async def __cancel(tasks: set):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def race(sources: list[IPSource], client: httpx.AsyncClient, hedge_delay: float) -> Optional[str]:
+    """Return the first valid answer.
+    The healthiest source is asked first; the next one is started when a source fails or has not
+    answered within hedge_delay seconds, so slow providers only cost time when they are needed.
+    """
+    queue = sorted(sources, key=lambda s: s.score)
+    pending: set = set()
+    while queue or pending:
+        if queue:
+            source = queue.pop(0)
+            pending.add(asyncio.ensure_future(source.fetch(client)))
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay if queue else None,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.result():
+                await __cancel(pending)
+                return task.result()
+    return None
+
+
+async def quorum(sources: list[IPSource], client: httpx.AsyncClient, required: int) -> Optional[str]:
+    """Ask every source at once and return the first IP reported by at least `required` of them."""
+    pending = {asyncio.ensure_future(source.fetch(client)) for source in sorted(sources, key=lambda s: s.score)}
+    votes: dict = {}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            ip = task.result()
+            if ip:
+                votes[ip] = votes.get(ip, 0) + 1
+                if votes[ip] >= required:
+                    await __cancel(pending)
+                    return ip
+    if votes:
+        error(f"IP sources disagree and no address reached a quorum of {required}: {votes}")
+    return None
+
+
+IP_SOURCES: list[IPSource] = build_sources(IP_SOURCE_NAMES, IP_SOURCE_CUSTOM_URL, IP_SOURCE_TIMEOUT) \
+    if 4 in IP_VERSIONS else []
+IP_SOURCES_V6: list[IPSource] = build_sources(IP_SOURCE_NAMES, IP_SOURCE_CUSTOM_URL_V6, IP_SOURCE_TIMEOUT, 6) \
+    if 6 in IP_VERSIONS else []
+__group_sources: dict = {}  # (names, custom_url, custom_url_v6) -> {version: sources}
+
+
+def get_sources_by_version(names: Optional[tuple] = None, custom_url: str = '', custom_url_v6: str = '',
+                           versions: list[int] = IP_VERSIONS) -> dict:
+    """The sources of every IP version for a host group. Without names, the global IP_SOURCES.
+    Groups with the same configuration get the same IPSource objects, so they share the health scores.
+    """
+    if names is None:
+        return {version: IP_SOURCES_V6 if version == 6 else IP_SOURCES for version in versions}
+    key = (tuple(names), custom_url, custom_url_v6)
+    if key not in __group_sources:
+        __group_sources[key] = {
+            4: build_sources(list(names), custom_url, IP_SOURCE_TIMEOUT) if 4 in versions else [],
+            6: build_sources(list(names), custom_url_v6, IP_SOURCE_TIMEOUT, 6) if 6 in versions else []
+        }
+    return {version: __group_sources[key][version] for version in versions}
+
+
+async def __discover(sources: list[IPSource], client: httpx.AsyncClient, mode: str, required: int) -> Optional[str]:
+    if not sources:
+        error("No IP sources are configured.")
+        return None
+    if mode == MODE_QUORUM:
+        if required > len(sources):
+            warn(f"IP_QUORUM is {required}, but only {len(sources)} IP sources are configured.")
+        return await quorum(sources, client, required)
+    return await race(sources, client, IP_HEDGE_DELAY)
+
+
+async def __discover_all(sources_by_version: dict, client: httpx.AsyncClient, mode: str,
+                         required: int) -> dict:
+    versions = list(sources_by_version)
+    ips = await asyncio.gather(*(__discover(sources_by_version[version], client, mode, required)
+                                 for version in versions), return_exceptions=True)
+    results = {}
+    for version, ip in zip(versions, ips):
+        if isinstance(ip, BaseException):
+            error(f"Error discovering the external IPv{version} address: {ip}")
+            ip = None
+        results[version] = ip
+    return results
+
+
+def discover_ips(versions: list[int] = IP_VERSIONS, mode: str = IP_DISCOVERY_MODE,
+                 required: int = IP_QUORUM, sources_by_version: Optional[dict] = None) -> dict:
+    """Discover the external address of every IP version at the same time, so a dual-stack check
+    takes as long as the slower of the two.
+
+    Args:
+        sources_by_version (Optional[dict]): The sources of each version (see get_sources_by_version).
+            Defaults to the global IP_SOURCES and IP_SOURCES_V6.
+
+    Returns:
+        dict: The address of each version (4 and/or 6), or None where it could not be discovered
+    """
+    if sources_by_version is None:
+        sources_by_version = get_sources_by_version(versions=versions)
+    client = client_manager.get_async_ip_client()
+    return client_manager.run(__discover_all(sources_by_version, client, mode, required))
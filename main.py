@@ -1,13 +1,23 @@
-import api
 import threading
 import sys
 import cfupdater
+from globals import API_PORT, API_MODE, API_MODE_PROCESS
 
 if __name__ == '__main__':
-    # Start API in background thread
     sys.tracebacklimit = 0
-    api_thread = threading.Thread(target=api.start_api)
-    api_thread.daemon = True
-    api_thread.start()
+    if API_PORT > 0:
+        # Start API in background thread. FastAPI and uvicorn are only imported when the API is enabled
+        import api
+        target = api.start_api
+        if API_MODE == API_MODE_PROCESS:
+            # The API runs in other processes: they read the status from shared memory and forward the pushes
+            from metrics import registry
+            from shared_status import SharedStatusWriter, collect_status, start_push_listener
+            SharedStatusWriter(collect_status(registry.expose)).start()
+            start_push_listener(cfupdater.push_external_ips)
+            target = api.start_api_process
+        api_thread = threading.Thread(target=target)
+        api_thread.daemon = True
+        api_thread.start()
 
     cfupdater.main()
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from rate_limiter import rate_limiter, get_priority
+from status import get_status
+
+# Latency buckets in seconds, from a fast keep-alive round trip up to the slowest timeouts
+DEFAULT_BUCKETS: tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class of the metrics below. Values are kept per tuple of label values."""
+    kind: str = ''
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: dict = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        if not label_names:
+            self._values[()] = 0.0
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Gauge(_Metric):
+    """A gauge set explicitly, or computed at scrape time when a callback is given."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (),
+                 callback: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(name, documentation, label_names)
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        if self._callback is not None:
+            value = self._callback()
+            return [] if value is None else [f'{self.name} {_format_value(value)}']
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, the sum and the total count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block, whether it raises or not."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = {key: (list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """Render every metric in the Prometheus text exposition format (version 0.0.4)."""
+        return '\n'.join(metric.expose() for metric in self._metrics) + '\n'
+
+
+CONTENT_TYPE: str = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+
+ip_discovery_seconds = registry.register(Histogram(
+    'dyncfdns_ip_discovery_seconds', 'Latency of IP discovery requests, per provider and outcome.',
+    ('provider', 'outcome')))
+cloudflare_request_seconds = registry.register(Histogram(
+    'dyncfdns_cloudflare_request_seconds', 'Latency of Cloudflare API calls, per operation and zone.',
+    ('operation', 'zone')))
+cycle_seconds = registry.register(Histogram(
+    'dyncfdns_cycle_seconds', 'Total duration of an update cycle.'))
+record_updates_total = registry.register(Counter(
+    'dyncfdns_record_updates_total', 'DNS records updated successfully.'))
+record_failures_total = registry.register(Counter(
+    'dyncfdns_record_failures_total', 'DNS record updates that failed.'))
+rate_limited_total = registry.register(Counter(
+    'dyncfdns_cloudflare_rate_limited_total', 'Cloudflare responses with status 429.'))
+skipped_cycles_total = registry.register(Counter(
+    'dyncfdns_skipped_cycles_total', 'Update cycles that made no writes, per reason.', ('reason',)))
+dns_probe_total = registry.register(Counter(
+    'dyncfdns_dns_probe_total', 'Records checked against the authoritative nameservers, per outcome.', ('outcome',)))
+host_count = registry.register(Gauge(
+    'dyncfdns_hosts', 'Number of monitored hosts.'))
+quarantined_records = registry.register(Gauge(
+    'dyncfdns_quarantined_records', 'DNS records left alone after too many failed updates, per host group.',
+    ('group',)))
+throttled_seconds_total = registry.register(Counter(
+    'dyncfdns_cloudflare_throttled_seconds_total', 'Time Cloudflare requests waited for the rate limiter, per priority.',
+    ('priority',)))
+rate_limit_budget = registry.register(Gauge(
+    'dyncfdns_cloudflare_budget_remaining', 'Cloudflare API requests that can be sent right now.',
+    callback=rate_limiter.remaining))
+
+
+def throttle_request(request):
+    """httpx request hook. Waits for the shared rate limiter before any Cloudflare request is sent,
+    including the retries the SDK makes on its own.
+    """
+    priority = get_priority()
+    waited = rate_limiter.acquire(priority)
+    if waited:
+        throttled_seconds_total.inc(waited, priority=priority)
+
+
+async def throttle_request_async(request):
+    priority = get_priority()
+    waited = await rate_limiter.acquire_async(priority)
+    if waited:
+        throttled_seconds_total.inc(waited, priority=priority)
+
+
+def observe_rate_limit(response):
+    """httpx response hook. Sees every response, including the ones the SDK retries on its own.
+    Feeds the remaining budget and any Retry-After back to the rate limiter.
+    """
+    rate_limiter.observe_response(response.status_code, response.headers)
+    if response.status_code == 429:
+        rate_limited_total.inc()
+
+
+async def observe_rate_limit_async(response):
+    observe_rate_limit(response)
+
+
+def __seconds_since_last_update() -> Optional[float]:
+    last_update = get_status().last_update
+    return None if last_update is None else time.time() - last_update.timestamp()
+
+
+seconds_since_last_update = registry.register(Gauge(
+    'dyncfdns_seconds_since_last_update', 'Seconds since the last successful DNS update.',
+    callback=__seconds_since_last_update))
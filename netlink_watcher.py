@@ -0,0 +1,97 @@
+import socket
+import struct
+import threading
+from typing import Callable, Optional
+
+from singleton_logger import info, warn, error
+
+# Constants from linux/netlink.h and linux/rtnetlink.h
+NETLINK_ROUTE: int = 0
+RTMGRP_IPV4_IFADDR: int = 0x10
+RTMGRP_IPV4_ROUTE: int = 0x40
+RTMGRP_IPV6_IFADDR: int = 0x100
+RTMGRP_IPV6_ROUTE: int = 0x400
+RTM_NEWADDR: int = 20
+RTM_DELADDR: int = 21
+RTM_NEWROUTE: int = 24
+RTM_DELROUTE: int = 25
+RT_SCOPE_UNIVERSE: int = 0
+
+NLMSG_HEADER = struct.Struct('=IHHII')  # length, type, flags, sequence, port id
+IFADDRMSG = struct.Struct('=BBBBI')     # family, prefix length, flags, scope, interface index
+RTMSG = struct.Struct('=BBBBBBBBI')     # family, dst length, src length, tos, table, protocol, scope, type, flags
+
+
+def is_relevant_change(message_type: int, payload: bytes) -> bool:
+    """Only global addresses and default routes can change the public IP. Everything else is noise."""
+    if message_type in (RTM_NEWADDR, RTM_DELADDR) and len(payload) >= IFADDRMSG.size:
+        return IFADDRMSG.unpack_from(payload)[3] == RT_SCOPE_UNIVERSE
+    if message_type in (RTM_NEWROUTE, RTM_DELROUTE) and len(payload) >= RTMSG.size:
+        return RTMSG.unpack_from(payload)[1] == 0
+    return False
+
+
+def parse_messages(data: bytes) -> list[tuple[int, bytes]]:
+    """Split a netlink datagram into (message type, payload) pairs."""
+    messages = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, message_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        messages.append((message_type, data[offset + NLMSG_HEADER.size:offset + length]))
+        offset += (length + 3) & ~3  # Messages are 4-byte aligned
+    return messages
+
+
+class NetlinkWatcher:
+    """Listens to rtnetlink address and route events and calls on_change when the public IP may have changed.
+
+    Only useful where the public address (or the default route) lives on a local interface, for example
+    with network_mode: host. The regular UPDATE_INTERVAL polling keeps running as the fallback.
+    """
+
+    def __init__(self, on_change: Callable[[], None]):
+        self._on_change = on_change
+        self._socket: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Subscribe to the rtnetlink groups. Returns False if netlink is not available on this host."""
+        if not hasattr(socket, 'AF_NETLINK'):
+            warn("Netlink is only available on Linux. Falling back to polling.")
+            return False
+        try:
+            self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            self._socket.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+            self._socket.settimeout(1.0)  # Lets stop() end the thread without waiting for an event
+        except OSError as e:
+            warn(f"Could not subscribe to netlink events: {e}. Falling back to polling.")
+            self._socket = None
+            return False
+
+        self._thread = threading.Thread(target=self._run, name='NetlinkWatcher', daemon=True)
+        self._thread.start()
+        info("Watching netlink for address and route changes.")
+        return True
+
+    def _run(self):
+        while True:
+            sock = self._socket
+            if sock is None:
+                return
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self._socket is not None:
+                    error(f"Netlink watcher stopped: {e}. Falling back to polling.")
+                return
+            if any(is_relevant_change(message_type, payload) for message_type, payload in parse_messages(data)):
+                self._on_change()
+
+    def stop(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            sock.close()
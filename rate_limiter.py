@@ -0,0 +1,115 @@
+import asyncio
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from globals import RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD, RATE_LIMIT_RESERVE
+from retry_queue import parse_retry_after
+from singleton_logger import warn
+
+PRIORITY_HIGH: str = 'high'  # Record updates after an IP change
+PRIORITY_LOW: str = 'low'    # Lookups, reconciliation and anything else that can wait
+
+# The priority of the Cloudflare requests made by the current thread or task
+__priority: ContextVar = ContextVar('cloudflare_request_priority', default=PRIORITY_HIGH)
+
+# Cloudflare's own view of the budget, e.g. 'ratelimit: "default";r=1150;t=240'
+RATELIMIT_HEADER_PATTERN = re.compile(r'(?:^|;)\s*r=(\d+)')
+
+
+class RateLimiter:
+    """Token bucket shared by every request sent to the Cloudflare API.
+
+    The bucket holds `capacity` tokens and refills at capacity/period tokens per second, like
+    Cloudflare's global limit of 1200 requests per 5 minutes. Low priority requests may not take
+    the bucket below `reserve` tokens, so an IP change can always be pushed right away, even in the
+    middle of a large reconciliation. After a 429, every request waits for the Retry-After delay.
+    """
+
+    def __init__(self, capacity: int, period: float, reserve: int):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        self.reserve = float(min(reserve, capacity - 1))
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, priority: str = PRIORITY_HIGH) -> float:
+        """Takes a token if the priority allows it.
+
+        Returns:
+            float: 0 if a token was taken, or else the number of seconds to wait before trying again
+        """
+        floor = 1.0 if priority == PRIORITY_HIGH else self.reserve + 1.0
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            if self._tokens >= floor:
+                self._tokens -= 1.0
+                return 0.0
+            return (floor - self._tokens) / self.rate
+
+    def acquire(self, priority: str = PRIORITY_HIGH) -> float:
+        """Blocks until a token is taken. Returns the number of seconds spent waiting."""
+        waited = 0.0
+        while (delay := self.try_acquire(priority)) > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    async def acquire_async(self, priority: str = PRIORITY_HIGH) -> float:
+        """Same as acquire(), without blocking the event loop."""
+        waited = 0.0
+        while (delay := self.try_acquire(priority)) > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+    def observe_response(self, status_code: int, headers):
+        """Adjusts the bucket to what Cloudflare reports: the remaining budget, and Retry-After on a 429."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            match = RATELIMIT_HEADER_PATTERN.search(headers.get('ratelimit', ''))
+            if match:
+                self._tokens = min(self._tokens, float(match.group(1)))
+            if status_code == 429:
+                retry_after = parse_retry_after(headers.get('retry-after'))
+                delay = retry_after if retry_after is not None else self.capacity / self.rate / 10
+                self._blocked_until = max(self._blocked_until, now + delay)
+                self._tokens = 0.0
+                warn(f"Cloudflare rate limit reached. Pausing API requests for {delay:.0f} seconds.")
+
+    def remaining(self) -> int:
+        """The number of requests that can be sent right now."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return 0 if now < self._blocked_until else int(self._tokens)
+
+
+def get_priority() -> str:
+    return __priority.get()
+
+
+@contextmanager
+def low_priority():
+    """Marks the Cloudflare requests made inside the with block as low priority."""
+    token = __priority.set(PRIORITY_LOW)
+    try:
+        yield
+    finally:
+        __priority.reset(token)
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_PERIOD, RATE_LIMIT_RESERVE)
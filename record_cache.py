@@ -0,0 +1,59 @@
+import hashlib
+import json
+import time
+from typing import Optional
+
+from globals import RECORD_CACHE_TTL, KEY_RECORD_CACHE, load_attribute_from_config, save_attribute_to_config
+from singleton_logger import info, warn
+
+# Only the resolved identity of each record is persisted. Its content is not: after a restart
+# it is assumed to be the saved previous IP, until the next reconciliation says otherwise.
+CACHED_FIELDS: tuple = ('host', 'domain', 'zone_id', 'record_type', 'record_id', 'proxied')
+
+
+def get_fingerprint(host_list: list[str], api_token: str, api_key: str, api_email: str,
+                    record_types: tuple = ('A',)) -> str:
+    """A hash of the host list, the credentials and the updated record types. Changing any of them invalidates the cache."""
+    material = json.dumps([sorted(host_list), api_token, api_key, api_email, list(record_types)])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def load_record_cache(fingerprint: str, ttl: int = RECORD_CACHE_TTL, key: str = KEY_RECORD_CACHE) -> Optional[dict]:
+    """
+    Loads the zone/record IDs saved by save_record_cache.
+
+    Returns:
+        Optional[dict]: The updatable hosts, without their record state, or None if the cache is
+            disabled, missing, older than `ttl` seconds or saved for another host list or account.
+        Each host group saves its cache under its own `key`.
+    """
+    if ttl <= 0:
+        return None
+    cache = load_attribute_from_config(key, {})
+    if not isinstance(cache, dict) or not cache:
+        return None
+    if cache.get('fingerprint') != fingerprint:
+        info("The host list or the credentials changed since the record cache was saved. Ignoring it.")
+        return None
+    age = time.time() - cache.get('saved_at', 0)
+    if not 0 <= age < ttl:
+        info(f"The record cache is {age:.0f} seconds old, more than RECORD_CACHE_TTL. Ignoring it.")
+        return None
+    hosts = cache.get('hosts')
+    if not isinstance(hosts, dict) or not all(isinstance(h, dict) and all(f in h for f in CACHED_FIELDS)
+                                              for h in hosts.values()):
+        warn("The record cache is malformed. Ignoring it.")
+        return None
+    return {record_key: {field: host_info[field] for field in CACHED_FIELDS} for record_key, host_info in hosts.items()}
+
+
+def save_record_cache(fingerprint: str, updatable_hosts: dict, key: str = KEY_RECORD_CACHE) -> bool:
+    """Persists the zone/record IDs of the updatable hosts, so a restart needs no lookup calls."""
+    if RECORD_CACHE_TTL <= 0:
+        return False
+    return save_attribute_to_config(key, {
+        'fingerprint': fingerprint,
+        'saved_at': time.time(),
+        'hosts': {record_key: {field: host_info.get(field) for field in CACHED_FIELDS}
+                  for record_key, host_info in updatable_hosts.items()}
+    })
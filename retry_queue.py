@@ -0,0 +1,97 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+from singleton_logger import info, warn
+
+
+def get_retry_after(exception: Optional[BaseException]) -> Optional[float]:
+    """Seconds to wait according to the Retry-After header of a 429/5xx response, if there is one."""
+    from cloudflare import APIStatusError
+    if not isinstance(exception, APIStatusError):
+        return None
+    if exception.status_code != 429 and exception.status_code < 500:
+        return None
+    return parse_retry_after(exception.response.headers.get('retry-after'))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header value, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryQueue:
+    """Tracks the hosts whose last update failed, when each one may be retried, and which are quarantined.
+
+    Failed hosts are retried with exponential backoff and jitter, never sooner than a Retry-After
+    sent by Cloudflare. A host that fails quarantine_after times in a row is quarantined: it is left
+    alone for quarantine_seconds and no longer counts against the result of a cycle.
+    """
+
+    def __init__(self, base_delay: float, max_delay: float, quarantine_after: int, quarantine_seconds: float):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.quarantine_after = quarantine_after
+        self.quarantine_seconds = quarantine_seconds
+        self._entries: dict = {}  # host -> {'failures': int, 'next_attempt': float, 'quarantined': bool}
+
+    def is_due(self, host: str, now: Optional[float] = None) -> bool:
+        entry = self._entries.get(host)
+        return entry is None or (now or time.monotonic()) >= entry['next_attempt']
+
+    def is_quarantined(self, host: str) -> bool:
+        entry = self._entries.get(host)
+        return entry is not None and entry['quarantined']
+
+    def record_success(self, host: str):
+        entry = self._entries.pop(host, None)
+        if entry is not None and entry['quarantined']:
+            info(f"{host} recovered and left quarantine.")
+
+    def record_failure(self, host: str, retry_after: Optional[float] = None, now: Optional[float] = None):
+        now = now or time.monotonic()
+        entry = self._entries.setdefault(host, {'failures': 0, 'next_attempt': now, 'quarantined': False})
+        entry['failures'] += 1
+        if entry['failures'] >= self.quarantine_after:
+            if not entry['quarantined']:
+                warn(f"{host} failed {entry['failures']} times in a row and is quarantined for "
+                     f"{self.quarantine_seconds:.0f} seconds.")
+            entry['quarantined'] = True
+            delay = self.quarantine_seconds
+        else:
+            backoff = min(self.max_delay, self.base_delay * 2 ** (entry['failures'] - 1))
+            delay = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        entry['next_attempt'] = now + delay
+
+    def forget_except(self, hosts: set):
+        """Drop hosts that no longer need an update, e.g. because they were fixed out of band."""
+        for host in set(self._entries) - hosts:
+            del self._entries[host]
+
+    def seconds_until_next_retry(self, now: Optional[float] = None) -> Optional[float]:
+        """Time until the earliest pending (non-quarantined) retry, or None if nothing is pending."""
+        now = now or time.monotonic()
+        pending = [entry['next_attempt'] for entry in self._entries.values() if not entry['quarantined']]
+        return max(0.0, min(pending) - now) if pending else None
+
+    def due_hosts(self, now: Optional[float] = None) -> list[str]:
+        """The hosts whose next attempt is due, quarantined or not."""
+        now = now or time.monotonic()
+        return [host for host, entry in self._entries.items() if now >= entry['next_attempt']]
+
+    def quarantined_hosts(self) -> list[str]:
+        """The hosts left alone after too many failures in a row (the dyncfdns_quarantined_records metric)."""
+        return [host for host, entry in self._entries.items() if entry['quarantined']]
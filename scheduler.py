@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import time
+from threading import Event
+from typing import Callable, Optional
+
+from host_groups import HostGroup
+from singleton_logger import info
+
+DUE_TOLERANCE: float = 0.5  # Groups due within this many seconds run with the ones due now, and share their IP discovery
+
+
+class GroupScheduler:
+    """Drives every host group from a single thread, with a heap of the time each group is due.
+
+    Each group runs at a fixed rate: its ticks are `interval` seconds apart from the start, however
+    long a cycle takes, and ticks missed while a cycle overran are skipped instead of run in a burst.
+    A group with failed records waiting for their backoff is also run when the first retry is due,
+    without moving its regular ticks. All the groups that are due together are handed to `run_groups`
+    in one call, so they can share a single IP discovery.
+
+    wake() and request_reload() may be called from any thread. A reload is applied between two
+    cycles, by the scheduler thread itself, so a cycle never sees a half-applied configuration.
+    """
+
+    def __init__(self, groups: list[HostGroup], run_groups: Callable[[list[HostGroup]], None], settle_delay: float,
+                 reload: Optional[Callable[[list[HostGroup]], list[HostGroup]]] = None):
+        self.groups = groups
+        self.run_groups = run_groups
+        self.settle_delay = settle_delay
+        self.reload = reload  # Returns the new groups. The ones that are kept must be the same objects
+        self._event = Event()
+        self._check_requested = False
+        self._woken_names: Optional[set] = None  # The groups to run when woken up. None: all of them
+        self._wake_reason = ''
+        self._reload_requested = False
+        self._sequence = itertools.count()  # Tie breaker: groups are never compared
+        self._next_ticks: dict = {}
+        self._heap: list = []
+
+    def _push(self, group: HostGroup, when: float):
+        heapq.heappush(self._heap, (when, next(self._sequence), group))
+
+    def _reschedule(self, group: HostGroup, now: float):
+        next_tick = self._next_ticks[group.name]
+        if next_tick <= now:
+            # Skip the ticks missed while the cycle ran, without losing the phase
+            next_tick += ((now - next_tick) // group.interval + 1) * group.interval
+            self._next_ticks[group.name] = next_tick
+        when = next_tick
+        next_retry = group.retry_queue.seconds_until_next_retry()
+        if next_retry is not None:
+            when = min(when, now + max(1.0, next_retry))
+        self._push(group, when)
+
+    def wake(self, names: Optional[set] = None, reason: str = 'Network change detected'):
+        """Run the named groups (by default, every group) right away, after settle_delay, instead of
+        waiting for their next tick. The wakes that come in during the settle delay are merged.
+        """
+        if names is None or self._woken_names is None and self._check_requested:
+            self._woken_names = None
+        else:
+            self._woken_names = (self._woken_names or set()) | set(names)
+        self._wake_reason = reason
+        self._check_requested = True
+        self._event.set()
+
+    def request_reload(self):
+        """Apply the reload callback before the next cycle."""
+        self._reload_requested = True
+        self._event.set()
+
+    def _apply_reload(self):
+        groups = self.reload(self.groups)
+        now = time.monotonic()
+        kept = {id(group) for group in groups}
+        self._heap = [entry for entry in self._heap if id(entry[2]) in kept]
+        heapq.heapify(self._heap)
+        for group in self.groups:
+            if id(group) not in kept:
+                del self._next_ticks[group.name]
+        for group in groups:
+            if group.name not in self._next_ticks:
+                # A new group is checked right away, then at its own interval
+                self._next_ticks[group.name] = now
+                self._push(group, now)
+        self.groups = groups
+
+    def _pop_due(self, now: float) -> list[HostGroup]:
+        due = []
+        while self._heap and self._heap[0][0] <= now + DUE_TOLERANCE:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def run_forever(self):
+        """Runs the groups until the thread is interrupted. Every group is run once right away."""
+        now = time.monotonic()
+        for group in self.groups:
+            self._next_ticks[group.name] = now
+            self._push(group, now)
+
+        while True:
+            if self._reload_requested and self.reload is not None:
+                self._reload_requested = False
+                self._apply_reload()
+            now = time.monotonic()
+            due = self._pop_due(now)
+            if not due:
+                if not self._event.wait(self._heap[0][0] - now if self._heap else None):
+                    continue
+                self._event.clear()
+                if not self._check_requested:
+                    continue
+                time.sleep(self.settle_delay)
+                # The changes reported during the settle delay are covered by this check
+                self._check_requested = False
+                names, self._woken_names = self._woken_names, None
+                info(f"{self._wake_reason}, checking the external IP now.")
+                # The woken groups run now. Their regular ticks stay where they are
+                due = [entry[2] for entry in self._heap if names is None or entry[2].name in names]
+                self._heap = [entry for entry in self._heap if names is not None and entry[2].name not in names]
+                heapq.heapify(self._heap)
+                if not due:
+                    continue
+
+            try:
+                self.run_groups(due)
+            finally:
+                now = time.monotonic()
+                for group in due:
+                    self._reschedule(group, now)
+                if self._heap:
+                    info(f"Next check in {max(0.0, self._heap[0][0] - now):.0f} seconds...")
@@ -0,0 +1,188 @@
+import json
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, Optional
+
+from status import StatusSnapshot, get_status
+from singleton_logger import warn, error
+
+# The updater publishes its status here for the API worker processes (API_MODE=process).
+# /dev/shm is memory, so writing the record every second never touches a disk.
+SHARED_DIR: str = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHARED_STATUS_FILE: str = os.path.join(SHARED_DIR, 'dyncfdns_status')
+PUSH_SOCKET_FILE: str = os.path.join(SHARED_DIR, 'dyncfdns_push.sock')
+INITIAL_SIZE: int = 1 << 20         # Bytes mapped at first. The file grows if the record does not fit
+REFRESH_INTERVAL: float = 1.0       # Seconds between two writes, so the metrics stay fresh
+PUSH_TIMEOUT: float = 5.0           # Seconds an API worker waits for the updater to apply a push
+MAX_DATAGRAM: int = 65536
+
+# sequence (odd while the payload is being written), payload length, CRC32 of the payload
+HEADER = struct.Struct('<QII')
+
+
+class SharedStatusWriter:
+    """Publishes the status and the metrics into a memory-mapped file, as one versioned record.
+
+    The record is guarded by a sequence lock: the sequence is odd while the payload is rewritten
+    and even once it is complete, so readers never wait for the writer, they just read again if
+    the sequence moved under them. The CRC also rejects a payload read while it was being written
+    on CPUs that reorder memory writes. There is a single writer, the thread started by start().
+    """
+
+    def __init__(self, collect: Callable[[], dict], path: str = SHARED_STATUS_FILE):
+        self.collect = collect
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = os.fstat(self._fd).st_size
+        self._sequence = 0
+        if size >= HEADER.size:
+            # Carry on from the sequence of a previous run: readers cache the payload by sequence
+            with mmap.mmap(self._fd, HEADER.size) as previous:
+                self._sequence = (HEADER.unpack_from(previous)[0] + 1) & ~1
+        if size < INITIAL_SIZE:
+            os.ftruncate(self._fd, INITIAL_SIZE)  # Never shrunk: a reader mapping the old size would fault
+        self._map = mmap.mmap(self._fd, max(size, INITIAL_SIZE))
+        self._last_payload = b''
+
+    def write(self, payload: bytes):
+        if HEADER.size + len(payload) > len(self._map):
+            size = max(len(self._map) * 2, HEADER.size + len(payload))
+            os.ftruncate(self._fd, size)
+            self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+        self._sequence += 1
+        HEADER.pack_into(self._map, 0, self._sequence, 0, 0)
+        self._map[HEADER.size:HEADER.size + len(payload)] = payload
+        self._sequence += 1
+        HEADER.pack_into(self._map, 0, self._sequence, len(payload), zlib.crc32(payload))
+
+    def publish(self):
+        payload = json.dumps(self.collect(), default=str, separators=(',', ':')).encode()
+        if payload != self._last_payload:
+            self.write(payload)
+            self._last_payload = payload
+
+    def run(self):
+        version = None
+        last_write = 0.0
+        while True:
+            try:
+                # A new snapshot is published within a tick, the rest at least every REFRESH_INTERVAL
+                if get_status().version != version or time.monotonic() - last_write >= REFRESH_INTERVAL:
+                    version = get_status().version
+                    last_write = time.monotonic()
+                    self.publish()
+            except Exception as e:
+                error(f"Failed to publish the shared status: {e}")
+            time.sleep(REFRESH_INTERVAL / 10)
+
+    def start(self):
+        threading.Thread(target=self.run, name='SharedStatusWriter', daemon=True).start()
+
+
+class SharedStatusReader:
+    """Reads the record of a SharedStatusWriter, from an API worker process.
+
+    Only a few bytes are read while the record does not change: the payload is copied and decoded
+    once per new sequence, then served from the cache.
+    """
+
+    def __init__(self, path: str = SHARED_STATUS_FILE):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._sequence = -1
+        self._record: dict = {}
+        self._status = StatusSnapshot()
+
+    def _open(self) -> bool:
+        try:
+            with open(self.path, 'rb') as f:
+                # The file descriptor can be closed: the mapping stays valid
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return True
+        except (OSError, ValueError):
+            return False  # The updater has not started yet
+
+    def _refresh(self):
+        if self._map is None and not self._open():
+            return
+        for _ in range(100):
+            sequence, length, checksum = HEADER.unpack_from(self._map)
+            if sequence == self._sequence:
+                return
+            if sequence & 1:
+                time.sleep(0)  # Being written. Let the writer finish
+                continue
+            if HEADER.size + length > len(self._map):
+                self._map.close()
+                if not self._open():
+                    return
+                continue
+            payload = self._map[HEADER.size:HEADER.size + length]
+            if HEADER.unpack_from(self._map)[0] != sequence or zlib.crc32(payload) != checksum:
+                continue
+            record = json.loads(payload)
+            status = record.get('status', {})
+            for field in ('last_check', 'last_update'):
+                if status.get(field):
+                    status[field] = datetime.fromisoformat(status[field])
+            status['hosts'] = tuple(status.get('hosts', ()))
+            self._status = StatusSnapshot(**status)
+            self._record = record
+            self._sequence = sequence
+            return
+        warn("Could not read a consistent shared status. Serving the previous one.")
+
+    def status(self) -> StatusSnapshot:
+        self._refresh()
+        return self._status
+
+    def metrics(self) -> str:
+        self._refresh()
+        return self._record.get('metrics', '')
+
+
+def collect_status(metrics: Callable[[], str]) -> Callable[[], dict]:
+    """What the updater publishes for the API workers."""
+    return lambda: {'status': asdict(get_status()), 'metrics': metrics()}
+
+
+def start_push_listener(push: Callable[[list, dict], dict], path: str = PUSH_SOCKET_FILE):
+    """Applies the dyndns2 pushes the API workers forward to the updater (see forward_push), on a Unix socket."""
+    if os.path.exists(path):
+        os.unlink(path)  # Left by a previous run
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+
+    def serve():
+        while True:
+            try:
+                data, address = listener.recvfrom(MAX_DATAGRAM)
+                request = json.loads(data)
+                listener.sendto(json.dumps(push(request['hostnames'], request['ips'])).encode(), address)
+            except Exception as e:
+                error(f"Failed to apply a forwarded push: {e}")
+
+    threading.Thread(target=serve, name='PushListener', daemon=True).start()
+
+
+def forward_push(hostnames: list[str], ips: dict, path: str = PUSH_SOCKET_FILE) -> Optional[dict]:
+    """Hands a push to the updater process and waits for its answer. None if the updater did not answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as client:
+        client.bind('')  # An abstract address, so the updater can answer (Linux only)
+        client.settimeout(PUSH_TIMEOUT)
+        try:
+            client.sendto(json.dumps({'hostnames': hostnames, 'ips': ips}).encode(), path)
+            return json.loads(client.recv(MAX_DATAGRAM))
+        except (OSError, ValueError) as e:
+            warn(f"Could not forward the push to the updater: {e}")
+            return None
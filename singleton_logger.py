@@ -1,8 +1,48 @@
+import atexit
+import gzip
+import json
 import logging
-import threading
+import logging.handlers
 import os
+import queue
+import shutil
+import threading
 from typing import Optional
 
+LOG_DIR: str = "/app/logs"
+LOG_FILE: str = os.path.join(LOG_DIR, "dyncfdns.log")
+
+
+def _get_int_env(name: str, default: int) -> int:
+    # globals.py logs through this module, so the logger reads its own settings
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _gzip_rotator(source: str, dest: str):
+    """Compress a rotated log file instead of just renaming it."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
 
 class SingletonLogger:
     """Thread-safe singleton logger."""
@@ -10,6 +50,7 @@ class SingletonLogger:
     _instance: Optional['SingletonLogger'] = None
     _lock = threading.Lock()
     _logger: Optional[logging.Logger] = None
+    _listener: Optional[logging.handlers.QueueListener] = None
     _initialized = False
 
     def __new__(cls) -> 'SingletonLogger':
@@ -26,8 +67,30 @@ class SingletonLogger:
                     self._setup_logger()
                     self._initialized = True
 
+    @staticmethod
+    def _create_file_handler() -> logging.Handler:
+        """Rotating file handler: by size (LOG_MAX_BYTES) or, if LOG_ROTATE_WHEN is set, by time."""
+        os.makedirs(LOG_DIR, exist_ok=True)
+        backup_count = _get_int_env('LOG_BACKUP_COUNT', 5)
+        rotate_when = os.getenv('LOG_ROTATE_WHEN', '')
+        if rotate_when:
+            file_handler = logging.handlers.TimedRotatingFileHandler(LOG_FILE, when=rotate_when,
+                                                                     backupCount=backup_count, utc=True)
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(LOG_FILE,
+                                                                maxBytes=_get_int_env('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                                                                backupCount=backup_count)
+        if os.getenv('LOG_COMPRESS', 'true').lower() in ['true', '1', 'yes']:
+            file_handler.namer = lambda name: name + '.gz'
+            file_handler.rotator = _gzip_rotator
+        return file_handler
+
     def _setup_logger(self):
-        """Setup the logger configuration."""
+        """Setup the logger configuration.
+
+        Callers only put records on a queue. A background listener thread formats them and does
+        the console and file writes, so neither the updater nor the API thread waits on disk I/O.
+        """
         self._logger = logging.getLogger('DynCFDNS')
         self._logger.setLevel(logging.DEBUG)
 
@@ -36,29 +99,45 @@ class SingletonLogger:
             self._logger.removeHandler(handler)
 
         # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-
+        if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+            formatter = JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S%z')
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                datefmt='%Y-%m-%d %H:%M:%S'
+            )
 
         # Console handler
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(formatter)
-        self._logger.addHandler(console_handler)
 
-        # Create file handler
-        log_dir = "/app/logs"
-        os.makedirs(log_dir, exist_ok=True)
-        file_handler = logging.FileHandler("/app/logs/dyncfdns.log")
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
-        self._logger.addHandler(file_handler)
+        handlers = [console_handler]
+        # Only one process may write the log file: the others would rotate it under its feet.
+        # The API processes ('process' mode) run with LOG_TO_FILE=false and log to the console only.
+        if os.getenv('LOG_TO_FILE', 'true').lower() in ['true', '1', 'yes']:
+            file_handler = self._create_file_handler()
+            file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+        # Non-blocking queue handler on the callers' side, writes on the listener thread
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                                        respect_handler_level=True)
+        self._listener.start()
+        atexit.register(self.stop)
 
         # Prevent propagation to root logger
         self._logger.propagate = False
 
+    def stop(self):
+        """Flush the queued records and stop the listener thread."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
     def debug(self, message: str):
         """Log debug message."""
         self._logger.debug(message)
@@ -0,0 +1,38 @@
+from dataclasses import dataclass, replace
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class StatusSnapshot:
+    """Immutable view of the updater state, as shown by the API.
+
+    The updater publishes a new snapshot at the end of each phase (startup, IP check, update).
+    Readers just take the current reference, so they never wait for the updater, even while it
+    is in the middle of network I/O.
+    """
+    version: int = 0
+    hosts: tuple = ()
+    last_check: Optional[datetime] = None
+    last_update: Optional[datetime] = None
+    current_ip: str = ''
+    current_ipv6: str = ''
+    check_interval: int = 0  # The shortest host group interval: the longest expected gap between checks
+
+
+__snapshot: StatusSnapshot = StatusSnapshot()
+__publish_lock: Lock = Lock()  # Only serializes writers; readers never take it
+
+
+def get_status() -> StatusSnapshot:
+    """Return the latest published snapshot. Lock-free: reading a module global is atomic."""
+    return __snapshot
+
+
+def publish_status(**changes) -> StatusSnapshot:
+    """Publish a new snapshot with the given fields changed and the version bumped."""
+    global __snapshot
+    with __publish_lock:
+        __snapshot = replace(__snapshot, version=__snapshot.version + 1, **changes)
+        return __snapshot
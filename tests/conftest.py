@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+# The DynCFDNS modules read their configuration at import time, and write the config file
+# relative to the working directory
+os.environ.setdefault('LOG_TO_FILE', 'false')
+os.environ.setdefault('API_TOKEN', 'test-token')
+os.chdir(tempfile.mkdtemp(prefix='dyncfdns-tests-'))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def config_file():
+    yield
+    # The config file is flushed in the background, or at exit: by then pytest is back in the invocation directory
+    from globals import flush_config
+    flush_config()
@@ -0,0 +1,142 @@
+import socketserver
+from itertools import count
+
+import pytest
+
+import cfupdater
+from dns_probe import (FLAG_AUTHORITATIVE, FLAG_RESPONSE, HEADER, QUESTION, QUERY_TYPES, RECORD, CLASS_IN,
+                       encode_name, probe_records, read_name)
+from fake_servers import FakeCloudflareState, make_cloudflare_handler, make_dns_handler, serve, serve_dns
+from host_groups import HostGroup
+
+TIMEOUT: float = 0.5
+credentials_ids = count()
+
+
+@pytest.fixture
+def cloudflare_state():
+    state = FakeCloudflareState()
+    state.seed(1, 3, content='198.51.100.1')
+    return state
+
+
+@pytest.fixture
+def nameserver(cloudflare_state):
+    server = serve_dns(make_dns_handler(cloudflare_state))
+    yield server.server_address
+    server.shutdown()
+
+
+def build_answer(query_id: int, name: str, query_type: int, addresses: list, flags: int) -> bytes:
+    answers = b''
+    for address in addresses:
+        raw = bytes(int(part) for part in address.split('.'))
+        answers += b'\xc0\x0c' + RECORD.pack(query_type, CLASS_IN, 300, len(raw)) + raw
+    return (HEADER.pack(query_id, flags, 1, len(addresses), 0, 0) + encode_name(name)
+            + QUESTION.pack(query_type, CLASS_IN) + answers)
+
+
+def make_scripted_handler(respond):
+    """A nameserver that sends the datagrams respond(query id, name, query type) returns."""
+
+    class ScriptedHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            data, sock = self.request
+            query_id = HEADER.unpack_from(data)[0]
+            name, offset = read_name(data, HEADER.size)
+            query_type, _ = QUESTION.unpack_from(data, offset)
+            for datagram in respond(query_id, name, query_type):
+                sock.sendto(datagram, self.client_address)
+
+    return ScriptedHandler
+
+
+@pytest.fixture
+def scripted_nameserver():
+    """Starts nameservers: scripted_nameserver(respond) returns the (ip, port) of one."""
+    servers = []
+
+    def start(respond):
+        server = serve_dns(make_scripted_handler(respond))
+        servers.append(server)
+        return server.server_address
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_probe_returns_the_served_addresses(cloudflare_state, nameserver):
+    answers = probe_records({'host0': ([nameserver], 'host0.bench-zone0.com', 'A'),
+                             'aaaa': ([nameserver], 'host1.bench-zone0.com', 'AAAA')}, TIMEOUT)
+
+    assert answers == {'host0': {'198.51.100.1'}, 'aaaa': set()}
+    assert cloudflare_state.dns_queries == 2
+
+
+def test_probe_returns_an_empty_set_on_nxdomain(nameserver):
+    assert probe_records({'missing': ([nameserver], 'missing.bench-zone0.com', 'A')}, TIMEOUT) == {'missing': set()}
+
+
+def test_probe_falls_over_to_the_next_server_without_an_authoritative_answer(nameserver, scripted_nameserver):
+    recursive = scripted_nameserver(lambda query_id, name, query_type: [
+        build_answer(query_id, name, query_type, ['203.0.113.66'], FLAG_RESPONSE)])
+
+    answers = probe_records({'host0': ([recursive, nameserver], 'host0.bench-zone0.com', 'A')}, TIMEOUT)
+
+    assert answers == {'host0': {'198.51.100.1'}}
+
+
+def test_probe_returns_none_when_no_server_answers(scripted_nameserver):
+    silent = scripted_nameserver(lambda query_id, name, query_type: [])
+
+    assert probe_records({'host0': ([silent], 'host0.bench-zone0.com', 'A')}, TIMEOUT) == {'host0': None}
+
+
+def test_probe_ignores_datagrams_with_another_id_or_question(scripted_nameserver):
+    flags = FLAG_RESPONSE | FLAG_AUTHORITATIVE
+    forger = scripted_nameserver(lambda query_id, name, query_type: [
+        build_answer((query_id + 1) % 65536, name, query_type, ['203.0.113.66'], flags),
+        build_answer(query_id, 'other.bench-zone0.com', query_type, ['203.0.113.67'], flags),
+        build_answer(query_id, name, QUERY_TYPES['AAAA'], [], flags),
+        build_answer(query_id, name, query_type, ['198.51.100.1'], flags),
+    ])
+
+    assert probe_records({'host0': ([forger], 'host0.bench-zone0.com', 'A')}, TIMEOUT) == {'host0': {'198.51.100.1'}}
+
+
+@pytest.fixture
+def probed_group(cloudflare_state, nameserver, monkeypatch):
+    """A host group of the seeded records, probed on the stand-in nameserver, read through the stand-in API."""
+    api = serve(make_cloudflare_handler(cloudflare_state))
+    monkeypatch.setenv('CLOUDFLARE_BASE_URL', f'http://127.0.0.1:{api.server_port}/client/v4')
+    monkeypatch.setattr(cfupdater, 'get_zone_nameservers', lambda cf, zone_id: [nameserver])
+    group = HostGroup('probe', [], f'token{next(credentials_ids)}', 'key', 'email')
+    for record in cloudflare_state.records.values():
+        group.hosts[record['name']] = {
+            'host': record['name'], 'zone_id': record['zone_id'], 'record_type': 'A', 'record_id': record['id'],
+            'content': record['content'], 'proxied': False, 'modified_on': record['modified_on']
+        }
+    yield group
+    api.shutdown()
+
+
+def test_probe_record_state_reads_only_the_mismatched_records_through_the_api(cloudflare_state, probed_group):
+    edited = next(iter(cloudflare_state.records.values()))
+    edited['content'] = '203.0.113.66'
+    cloudflare_state.reset_counters()
+
+    assert cfupdater.probe_record_state(probed_group, {'A': '198.51.100.1'}) == 1
+    assert cloudflare_state.dns_queries == 3
+    assert cloudflare_state.requests == {'records.list': 1}
+    assert probed_group.hosts[edited['name']]['content'] == '203.0.113.66'
+
+
+def test_probe_record_state_skips_proxied_records(cloudflare_state, probed_group):
+    for host_info in list(probed_group.hosts.values())[:2]:
+        host_info['proxied'] = True
+    cloudflare_state.reset_counters()
+
+    assert cfupdater.probe_record_state(probed_group, {'A': '198.51.100.1'}) == 0
+    assert cloudflare_state.dns_queries == 1
+    assert not cloudflare_state.requests
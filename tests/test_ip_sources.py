@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from fake_servers import make_ip_echo_handler, serve
+from ip_sources import IPSource, parse_json_ip, quorum, race
+
+
+@pytest.fixture
+def echo_server():
+    """Starts IP echo servers: echo_server(ip, latency) returns (state, url)."""
+    servers = []
+
+    def start(ip: str, latency: float = 0.0):
+        state = {'ip': ip, 'latency': latency, 'requests': 0}
+        server = serve(make_ip_echo_handler(state))
+        servers.append(server)
+        return state, f'http://127.0.0.1:{server.server_port}/'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_source(name: str, url: str, version: int = 4, timeout: float = 5.0) -> IPSource:
+    return IPSource(name, url, parse_json_ip, timeout, version)
+
+
+def run_strategy(strategy, sources: list, argument):
+    """Run race or quorum on a fresh client, in a new event loop."""
+    async def run():
+        async with httpx.AsyncClient() as client:
+            return await strategy(sources, client, argument)
+    return asyncio.run(run())
+
+
+def run_race(sources: list, hedge_delay: float):
+    return run_strategy(race, sources, hedge_delay)
+
+
+def run_quorum(sources: list, required: int):
+    return run_strategy(quorum, sources, required)
+
+
+def test_race_returns_the_first_valid_answer_and_cancels_the_rest(echo_server):
+    _, slow_url = echo_server('198.51.100.1', latency=2.0)
+    _, fast_url = echo_server('198.51.100.2')
+    slow, fast = make_source('slow', slow_url), make_source('fast', fast_url)
+
+    started = time.monotonic()
+    assert run_race([slow, fast], hedge_delay=0.0) == '198.51.100.2'
+    assert time.monotonic() - started < 1.5
+    # The slow source was cancelled: neither its answer nor a failure was counted
+    assert (fast.successes, slow.successes, slow.failures) == (1, 0, 0)
+    assert slow.latency > 0
+
+
+def test_race_skips_invalid_answers(echo_server):
+    _, bad_url = echo_server('not-an-ip')
+    _, good_url = echo_server('198.51.100.3')
+    bad, good = make_source('bad', bad_url), make_source('good', good_url)
+
+    assert run_race([bad, good], hedge_delay=5.0) == '198.51.100.3'
+    assert bad.failures == 1
+
+
+def test_race_hedges_after_the_delay(echo_server):
+    slow_state, slow_url = echo_server('198.51.100.1', latency=1.0)
+    fast_state, fast_url = echo_server('198.51.100.2')
+    slow, fast = make_source('slow', slow_url), make_source('fast', fast_url)
+
+    started = time.monotonic()
+    assert run_race([slow, fast], hedge_delay=0.1) == '198.51.100.2'
+    assert 0.1 <= time.monotonic() - started < 0.9
+    assert fast_state['requests'] == 1
+
+
+def test_race_does_not_hedge_a_source_that_answers_in_time(echo_server):
+    _, first_url = echo_server('198.51.100.1', latency=0.05)
+    second_state, second_url = echo_server('198.51.100.2')
+
+    assert run_race([make_source('first', first_url), make_source('second', second_url)],
+                    hedge_delay=2.0) == '198.51.100.1'
+    assert second_state['requests'] == 0
+
+
+def test_quorum_returns_the_address_enough_sources_agree_on(echo_server):
+    sources = [make_source(f'source{i}', echo_server(ip)[1])
+               for i, ip in enumerate(['198.51.100.9', '198.51.100.1', '198.51.100.1'])]
+
+    assert run_quorum(sources, required=2) == '198.51.100.1'
+
+
+def test_quorum_returns_none_when_the_sources_disagree(echo_server):
+    sources = [make_source(f'source{i}', echo_server(ip)[1])
+               for i, ip in enumerate(['198.51.100.1', '198.51.100.2', '198.51.100.3'])]
+
+    assert run_quorum(sources, required=2) is None
+
+
+def test_an_address_of_the_wrong_version_is_rejected(echo_server):
+    _, url = echo_server('198.51.100.1')
+    source = make_source('v6', url, version=6)
+
+    assert run_race([source], hedge_delay=0.0) is None
+    assert (source.successes, source.failures) == (0, 1)
+
+
+def test_a_failing_source_moves_to_the_back_of_the_queue(echo_server):
+    failing_state, failing_url = echo_server('not-an-ip')
+    healthy_state, healthy_url = echo_server('198.51.100.1')
+    failing, healthy = make_source('failing', failing_url), make_source('healthy', healthy_url)
+
+    assert run_race([failing, healthy], hedge_delay=5.0) == '198.51.100.1'
+    assert failing.score > healthy.score
+
+    assert run_race([failing, healthy], hedge_delay=5.0) == '198.51.100.1'
+    assert (failing_state['requests'], healthy_state['requests']) == (1, 2)
+
+
+def test_a_slow_source_moves_to_the_back_of_the_queue(echo_server):
+    slow_state, slow_url = echo_server('198.51.100.1', latency=0.3)
+    fast_state, fast_url = echo_server('198.51.100.2')
+    slow, fast = make_source('slow', slow_url), make_source('fast', fast_url)
+    fast.latency = 0.01  # Asked before, so it is not the first in the queue
+
+    assert run_race([slow, fast], hedge_delay=5.0) == '198.51.100.1'
+    assert slow.score > fast.score
+
+    assert run_race([slow, fast], hedge_delay=5.0) == '198.51.100.2'
+    assert (slow_state['requests'], fast_state['requests']) == (1, 1)
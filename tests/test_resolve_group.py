@@ -0,0 +1,24 @@
+from itertools import count
+
+import cfupdater
+from fake_servers import FakeCloudflareState, make_cloudflare_handler, serve
+from host_groups import HostGroup
+
+credentials_ids = count()
+
+
+def test_a_host_that_cannot_be_resolved_counts_one_failure_per_resolution(monkeypatch):
+    state = FakeCloudflareState()
+    hosts = state.seed(1, 2)
+    api = serve(make_cloudflare_handler(state))
+    monkeypatch.setenv('CLOUDFLARE_BASE_URL', f'http://127.0.0.1:{api.server_port}/client/v4')
+    try:
+        group = HostGroup('resolve', hosts + ['missing.bench-zone0.com'], f'resolve{next(credentials_ids)}',
+                          'key', 'email')
+
+        assert cfupdater.resolve_group(group)
+    finally:
+        api.shutdown()
+
+    assert {host_info['host'] for host_info in group.hosts.values()} == set(hosts)
+    assert group.unresolved._entries['missing.bench-zone0.com']['failures'] == 1
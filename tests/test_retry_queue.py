@@ -0,0 +1,14 @@
+from retry_queue import RetryQueue
+
+
+def test_hosts_are_quarantined_after_too_many_failures_in_a_row():
+    queue = RetryQueue(base_delay=1.0, max_delay=10.0, quarantine_after=3, quarantine_seconds=60.0)
+    for _ in range(3):
+        queue.record_failure('a.example.com', now=100.0)
+    queue.record_failure('b.example.com', now=100.0)
+
+    assert queue.quarantined_hosts() == ['a.example.com']
+    assert queue.seconds_until_next_retry(now=100.0) <= 1.0  # Only b is pending
+
+    queue.record_success('a.example.com')
+    assert queue.quarantined_hosts() == []
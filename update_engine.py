@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+from globals import UPDATE_CONCURRENCY, BATCH_UPDATES, BATCH_SIZE
+from http_clients import client_manager
+from metrics import cloudflare_request_seconds
+from singleton_logger import info, warn, error
+
+if TYPE_CHECKING:
+    from cloudflare import AsyncCloudflare
+
+
+async def __update_record(client: AsyncCloudflare, semaphore: asyncio.Semaphore, host_record: dict) -> bool:
+    async with semaphore:
+        try:
+            with cloudflare_request_seconds.time(operation='update', zone=host_record['zone_id']):
+                record = await client.dns.records.update(
+                    dns_record_id=host_record['record_id'],
+                    zone_id=host_record['zone_id'],
+                    content=host_record['content'],
+                    type=host_record['type'],
+                    name=host_record['name']
+                )
+            info(f"Updated DNS record for {host_record['name']} to {host_record['content']}")
+            return record is not None and getattr(record, 'success', True)
+        except Exception as e:
+            client_manager.report_failure(e, client)
+            host_record['error'] = e
+            error(f"Error updating DNS record for {host_record['name']}: {e}")
+            return False
+
+
+async def __batch_update_records(client: AsyncCloudflare, semaphore: asyncio.Semaphore, zone_id: str,
+                                 host_records: list[dict]) -> list[bool]:
+    """Sends one batch of patches for records of the same zone.
+    Falls back to single updates if Cloudflare rejects the batch as a whole.
+    """
+    async with semaphore:
+        try:
+            with cloudflare_request_seconds.time(operation='batch', zone=zone_id):
+                response = await client.dns.records.batch(
+                    zone_id=zone_id,
+                    patches=[{
+                        'id': host_record['record_id'],
+                        'type': host_record['type'],
+                        'name': host_record['name'],
+                        'content': host_record['content']
+                    } for host_record in host_records]
+                )
+        except Exception as e:
+            client_manager.report_failure(e, client)
+            warn(f"Batch update of {len(host_records)} records in zone {zone_id} was rejected: {e}\n"
+                 f"Falling back to single record updates.")
+            response = None
+
+    if response is None:
+        return list(await asyncio.gather(*(__update_record(client, semaphore, host_record)
+                                           for host_record in host_records)))
+
+    patched = {record.id: record for record in (response.patches or [])}
+    results = []
+    for host_record in host_records:
+        record = patched.get(host_record['record_id'])
+        if record is not None and record.content == host_record['content']:
+            info(f"Updated DNS record for {host_record['name']} to {host_record['content']}")
+            results.append(True)
+        else:
+            error(f"Batch update did not apply to the DNS record for {host_record['name']}")
+            results.append(False)
+    return results
+
+
+async def __batch_update_zones(client: AsyncCloudflare, semaphore: asyncio.Semaphore, host_records: list[dict],
+                               batch_size: int) -> list[bool]:
+    # Group the record positions by zone, so results can be put back in the original order
+    zones: dict = {}
+    for position, host_record in enumerate(host_records):
+        zones.setdefault(host_record['zone_id'], []).append(position)
+
+    chunks = [(zone_id, positions[start:start + batch_size])
+              for zone_id, positions in zones.items()
+              for start in range(0, len(positions), batch_size)]
+    chunk_results = await asyncio.gather(*(__batch_update_records(client, semaphore, zone_id,
+                                                                  [host_records[p] for p in positions])
+                                           for zone_id, positions in chunks))
+
+    results = [False] * len(host_records)
+    for (_, positions), chunk_result in zip(chunks, chunk_results):
+        for position, result in zip(positions, chunk_result):
+            results[position] = result
+    return results
+
+
+async def __update_records(client: AsyncCloudflare, host_records: list[dict], concurrency: int, batch: bool,
+                           batch_size: int) -> list[bool]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    if batch:
+        return await __batch_update_zones(client, semaphore, host_records, max(1, batch_size))
+    # gather() keeps the results in the same order as host_records
+    return list(await asyncio.gather(*(__update_record(client, semaphore, host_record)
+                                       for host_record in host_records)))
+
+
+def update_records_concurrently(api_token: str, api_key: str, api_email: str, host_records: list[dict],
+                                concurrency: int = UPDATE_CONCURRENCY, batch: bool = BATCH_UPDATES,
+                                batch_size: int = BATCH_SIZE) -> list[bool]:
+    """
+    Updates several DNS records at once using the async Cloudflare client.
+
+    At most `concurrency` requests are in flight at any time, so a fan-out of N records
+    takes roughly ceil(N / concurrency) round trips instead of N.
+    When `batch` is set, the records are grouped by zone and sent as batched patches of up to
+    `batch_size` records each, so every zone flips to the new IP in a single request.
+
+    Args:
+        api_token (str): Cloudflare API token for authentication
+        api_key (str): Cloudflare API key for authentication
+        api_email (str): Email associated with Cloudflare account
+        host_records (list[dict]): The records to write, with their 'record_id', 'zone_id', 'type', 'name' and 'content'.
+            When a call fails, the exception is stored in the record's 'error' key.
+        concurrency (int): Maximum number of simultaneous update calls
+        batch (bool): Whether to use the per-zone batch endpoint
+        batch_size (int): Maximum number of records per batch call
+
+    Returns:
+        list[bool]: One result per record, in the same order as host_records
+    """
+    if not host_records:
+        return []
+    client = client_manager.get_async_cloudflare(api_token, api_key, api_email)
+    return client_manager.run(__update_records(client, host_records, concurrency, batch, batch_size))
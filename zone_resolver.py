@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import TYPE_CHECKING, Optional
+
+from domains import get_domain
+from globals import ZONE_LOOKUP, ZONE_LOOKUP_ALL, ZONE_MATCH, ZONE_MATCH_SUFFIX, UPDATE_CONCURRENCY
+from http_clients import client_manager
+from metrics import cloudflare_request_seconds
+from rate_limiter import low_priority
+from singleton_logger import info, error
+
+if TYPE_CHECKING:
+    from cloudflare import AsyncCloudflare
+
+ZONE_CACHE_TTL: float = 3600.0        # Seconds a zone found by name is trusted
+MISSING_ZONE_CACHE_TTL: float = 300.0  # Seconds a name that is not a zone of the account is trusted to stay so
+ZONES_PER_PAGE: int = 50              # Largest page size accepted by the zones list endpoint
+
+__zone_cache: dict = {}    # (credentials, zone name) -> (zone id or None, expiry in time.monotonic())
+__name_servers: dict = {}  # zone id -> nameserver names, as returned with the zone
+
+
+def get_candidate_zones(host: str, mode: str = ZONE_MATCH) -> list[str]:
+    """The names of the zones a host may belong to: its registrable domain or, in 'suffix' mode,
+    every suffix of the host with at least two labels (see domains.get_zone_for_host).
+    """
+    if mode == ZONE_MATCH_SUFFIX:
+        labels = host.lower().rstrip('.').split('.')
+        return ['.'.join(labels[start:]) for start in range(len(labels) - 1)]
+    return [get_domain(host)]
+
+
+def get_zone_name_servers(zone_id: str) -> list[str]:
+    """The nameserver names of a zone seen by the last lookup, if any. Saves a zones.get call."""
+    return __name_servers.get(zone_id, [])
+
+
+async def __lookup_zone(client: AsyncCloudflare, semaphore: asyncio.Semaphore, name: str):
+    async with semaphore:
+        try:
+            with cloudflare_request_seconds.time(operation='lookup_zone'):
+                page = await client.zones.list(name=name)
+        except Exception as e:
+            client_manager.report_failure(e, client)
+            error(f"Error looking up zone {name}: {e}")
+            return e
+        return page.result[0] if page.result else None
+
+
+async def __lookup_zones(client: AsyncCloudflare, names: list[str], concurrency: int) -> list:
+    # Set here: the tasks run on the client manager's loop, which does not see the caller's context
+    with low_priority():
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        return list(await asyncio.gather(*(__lookup_zone(client, semaphore, name) for name in names)))
+
+
+def __list_all_zones(credentials: tuple) -> Optional[dict]:
+    cf = client_manager.get_cloudflare(*credentials)
+    zones = {}
+    try:
+        with low_priority(), cloudflare_request_seconds.time(operation='list_zones'):
+            # Iterating the result fetches the following pages as needed
+            for zone in cf.zones.list(per_page=ZONES_PER_PAGE):
+                zones[zone.name] = zone.id
+                __name_servers[zone.id] = list(zone.name_servers or [])
+    except Exception as e:
+        client_manager.report_failure(e, cf)
+        error(f"Error fetching zones: {e}\nCheck the API credentials and permissions.")
+        return None
+    info(f"Found {len(zones)} zones in the account.")
+    return zones
+
+
+def resolve_zones(api_token: str, api_key: str, api_email: str, host_list: list[str],
+                  lookup: str = ZONE_LOOKUP, concurrency: int = UPDATE_CONCURRENCY) -> Optional[dict]:
+    """
+    Finds the zones the hosts may belong to.
+
+    In 'name' mode, the zones are looked up by name, with one filtered query per candidate domain
+    (see get_candidate_zones) and at most `concurrency` queries at the same time. The answers, zone
+    or no zone, are cached, so resolving a few more hosts later only asks for the new domains.
+    In 'all' mode, every zone of the account is listed, page after page.
+
+    Returns:
+        Optional[dict]: {zone name: zone id} of the zones found, or None if none of the queries succeeded
+    """
+    credentials = (api_token, api_key, api_email)
+    if lookup == ZONE_LOOKUP_ALL:
+        return __list_all_zones(credentials)
+
+    names = list(dict.fromkeys(name for host in host_list for name in get_candidate_zones(host)))
+    now = time.monotonic()
+    missing = [name for name in names if __zone_cache.get((credentials, name), (None, 0.0))[1] <= now]
+    failed = 0
+    if missing:
+        client = client_manager.get_async_cloudflare(*credentials)
+        for name, zone in zip(missing, client_manager.run(__lookup_zones(client, missing, concurrency))):
+            if isinstance(zone, Exception):
+                failed += 1
+            elif zone is None:
+                __zone_cache[(credentials, name)] = (None, now + MISSING_ZONE_CACHE_TTL)
+            else:
+                __zone_cache[(credentials, name)] = (zone.id, now + ZONE_CACHE_TTL)
+                __name_servers[zone.id] = list(zone.name_servers or [])
+        info(f"Looked up {len(missing)} zones by name ({len(names) - len(missing)} cached).")
+    if missing and failed == len(names):
+        return None
+    return {name: __zone_cache[(credentials, name)][0] for name in names
+            if (credentials, name) in __zone_cache and __zone_cache[(credentials, name)][0] is not None}